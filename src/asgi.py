@@ -0,0 +1,21 @@
+from a2wsgi import WSGIMiddleware
+from src.main import app as flask_app
+from src.routes.admin_stream import STATS_STREAM_PATH, stats_stream
+import os
+
+# ASGI entrypoint: `uvicorn src.asgi:app`
+# Uvicorn owns the sockets on a single event loop (keep-alive, slow clients,
+# webhook bursts) and only hands complete requests to the Flask app. Every
+# view is blocking I/O (DB, Telegram API), so the pool is sized well above
+# the CPU count.
+WSGI_THREADS = int(os.getenv('WSGI_THREADS', '100'))
+
+wsgi_app = WSGIMiddleware(flask_app, workers=WSGI_THREADS)
+
+async def app(scope, receive, send):
+    # The admin stats stream stays open for minutes, so it runs on the event
+    # loop instead of holding one of the WSGI threads
+    if scope['type'] == 'http' and scope['path'] == STATS_STREAM_PATH:
+        await stats_stream(flask_app, scope, receive, send)
+    else:
+        await wsgi_app(scope, receive, send)
@@ -1,16 +1,22 @@
 import os
-import sys
-# DON'T CHANGE THIS !!!
-sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
-
-from flask import Flask, send_from_directory, request, jsonify
+from flask import Flask, Blueprint, Response, send_from_directory, request, jsonify
+from flask.json.provider import JSONProvider
 from src.models.database import db
 from src.routes.user import user_bp
 from src.routes.admin import admin_bp
 from src.routes.webhook import webhook_bp
-from src.services.telegram_bot import TelegramBotService
+from src.services.telegram_bot import get_bot
+from src.services.audit_service import start_audit_writer
+from src.services._profiling import log_request_query_counts
 from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from decimal import Decimal
+from functools import lru_cache
 import logging
+import orjson
+import re
+import sqlite3
 
 # Load environment variables
 load_dotenv()
@@ -22,100 +28,221 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
-
-# Configuration
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}")
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-# Initialize database
-db.init_app(app)
-
-# Register blueprints
-app.register_blueprint(user_bp, url_prefix='/api')
-app.register_blueprint(admin_bp, url_prefix='/admin')
-app.register_blueprint(webhook_bp, url_prefix='/webhook')
-
-# Initialize Telegram bot
-telegram_bot = None
-if os.getenv('TELEGRAM_BOT_TOKEN'):
-    telegram_bot = TelegramBotService(
-        token=os.getenv('TELEGRAM_BOT_TOKEN'),
-        app_context=app.app_context
-    )
-    logger.info("Telegram bot service initialized")
-else:
-    logger.warning("TELEGRAM_BOT_TOKEN not found in environment variables")
-
-# Create database tables
-with app.app_context():
-    try:
-        # Ensure database directory exists
-        import os
-        db_path = app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', '')
-        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+# Bot update delivery: 'webhook' (production) or 'polling' (long polling)
+TELEGRAM_WEBHOOK_URL = os.getenv('TELEGRAM_WEBHOOK_URL')
+BOT_MODE = os.getenv('BOT_MODE', 'webhook' if TELEGRAM_WEBHOOK_URL else 'polling')
+TELEGRAM_BOT_CONFIGURED = bool(os.getenv('TELEGRAM_BOT_TOKEN'))
+
+# Filesystem locations, resolved once
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+DB_FILE = os.path.join(BASE_DIR, 'database', 'app.db')
+
+main_bp = Blueprint('main', __name__)
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Enable WAL so readers don't block on the bot's writes"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute('PRAGMA mmap_size=268435456')
+    cursor.execute('PRAGMA cache_size=-64000')
+    cursor.close()
+
+def _json_default(obj):
+    """Serialize types orjson does not handle natively"""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+class ORJSONProvider(JSONProvider):
+    """JSON provider backed by orjson (datetimes, enums and dataclasses natively)"""
+    option = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_json_default, option=self.option).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=_json_default, option=self.option),
+            mimetype='application/json'
+        )
+
+def create_app():
+    """Create and configure the Flask application"""
+    app = Flask(__name__, static_folder=STATIC_DIR)
+    app.json = ORJSONProvider(app)
+    
+    # Configuration
+    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', f"sqlite:///{DB_FILE}")
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Let the front server (Apache mod_xsendfile, lighttpd) stream static files
+    app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', 'False').lower() == 'true'
+    if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            'pool_size': 20,
+            'max_overflow': 40,
+            'pool_pre_ping': True,
+            'pool_recycle': 1800
+        }
+    
+    # Initialize database
+    db.init_app(app)
+    
+    # Register blueprints
+    app.register_blueprint(main_bp)
+    app.register_blueprint(user_bp, url_prefix='/api')
+    app.register_blueprint(admin_bp, url_prefix='/admin')
+    app.register_blueprint(webhook_bp, url_prefix='/webhook')
+    
+    # Admin audit entries are batch-written off the request path
+    start_audit_writer(app)
+    
+    # Error handlers
+    app.register_error_handler(404, not_found)
+    app.register_error_handler(500, internal_error)
+    
+    # Log lazy relationship loads (N+1 queries) in development
+    if os.getenv('FLASK_ENV') == 'development':
+        try:
+            from nplusone.ext.flask_sqlalchemy import NPlusOne
+            app.config['NPLUSONE_LOGGER'] = logging.getLogger('nplusone')
+            app.config['NPLUSONE_LOG_LEVEL'] = logging.WARN
+            NPlusOne(app)
+        except ImportError:
+            logger.warning("nplusone not installed, N+1 query detection disabled")
         
-        db.create_all()
-        logger.info("Database tables created")
-    except Exception as e:
-        logger.error(f"Error creating database tables: {e}")
-        # Continue without database for testing
-
-@app.route('/', defaults={'path': ''})
-@app.route('/<path:path>')
+        # Warn about requests that run an unusual number of SQL statements
+        with app.app_context():
+            log_request_query_counts(app, db.engine)
+    
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create database tables"""
+        init_db(app)
+    
+    # One-shot schema setup for deployments without a separate init step
+    if os.getenv('RUN_INIT') == '1':
+        init_db(app)
+    
+    return app
+
+def init_db(app):
+    """Create database tables"""
+    with app.app_context():
+        try:
+            # Ensure the SQLite database directory exists
+            db_uri = app.config['SQLALCHEMY_DATABASE_URI']
+            if db_uri.startswith('sqlite:///'):
+                db_dir = os.path.dirname(db_uri[len('sqlite:///'):])
+                if db_dir:
+                    os.makedirs(db_dir, exist_ok=True)
+            
+            db.create_all()
+            logger.info("Database tables created")
+        except Exception as e:
+            logger.error(f"Error creating database tables: {e}")
+            # Continue without database for testing
+
+# Content-hashed bundle names (app.3f9a1c2e.js) never change content
+HASHED_ASSET_PATTERN = re.compile(r'\.[0-9a-f]{8,}\.')
+
+STATIC_ROOT = os.path.realpath(STATIC_DIR)
+INDEX_EXISTS = os.path.isfile(os.path.join(STATIC_ROOT, 'index.html'))
+
+# First path segments the SPA handles client-side; anything else that is not
+# a static file (scanner probes like /.env, /wp-login.php) gets a bare 404
+SPA_ROUTE_PREFIXES = frozenset(
+    [''] + [p.strip().strip('/') for p in os.getenv('SPA_ROUTES', '').split(',') if p.strip()]
+)
+
+@lru_cache(maxsize=4096)
+def static_file_exists(path):
+    """Check whether a static asset exists (cached per path, misses included)"""
+    if path.startswith('/') or '..' in path.split('/'):
+        return False
+    return os.path.isfile(os.path.join(STATIC_ROOT, path))
+
+@main_bp.route('/', defaults={'path': ''})
+@main_bp.route('/<path:path>')
 def serve(path):
     """Serve static files and handle SPA routing"""
-    static_folder_path = app.static_folder
-    if static_folder_path is None:
-        return "Static folder not configured", 404
-
-    if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
-        return send_from_directory(static_folder_path, path)
+    if path != "" and static_file_exists(path):
+        response = send_from_directory(STATIC_ROOT, path, conditional=True)
+        if HASHED_ASSET_PATTERN.search(path):
+            response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        else:
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
     else:
-        index_path = os.path.join(static_folder_path, 'index.html')
-        if os.path.exists(index_path):
-            return send_from_directory(static_folder_path, 'index.html')
+        if path.split('/', 1)[0] not in SPA_ROUTE_PREFIXES:
+            return not_found(None)
+        if INDEX_EXISTS:
+            # Always revalidate index.html so SPA upgrades show up immediately
+            response = send_from_directory(STATIC_ROOT, 'index.html', conditional=True)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
         else:
             return "index.html not found", 404
 
-@app.route('/health')
+_HEALTH_JSON = orjson.dumps({
+    'status': 'healthy',
+    'telegram_bot_configured': TELEGRAM_BOT_CONFIGURED,
+    'database_connected': True
+})
+
+@main_bp.route('/health')
 def health_check():
     """Health check endpoint"""
-    return jsonify({
-        'status': 'healthy',
-        'telegram_bot_configured': telegram_bot is not None,
-        'database_connected': True
-    })
+    return Response(_HEALTH_JSON, mimetype='application/json')
 
-@app.route('/api/bot/info')
+@main_bp.route('/api/bot/info')
 def bot_info():
     """Get bot information"""
-    if not telegram_bot:
+    if not get_bot():
         return jsonify({'error': 'Bot not configured'}), 500
     
     return jsonify({
         'bot_configured': True,
-        'webhook_configured': bool(os.getenv('TELEGRAM_WEBHOOK_URL'))
+        'webhook_configured': bool(TELEGRAM_WEBHOOK_URL)
     })
 
-# Error handlers
-@app.errorhandler(404)
 def not_found(error):
     return jsonify({'error': 'Not found'}), 404
 
-@app.errorhandler(500)
 def internal_error(error):
-    db.session.rollback()
+    # Only roll back if the failed request left a transaction open; the
+    # session itself is removed by Flask-SQLAlchemy's teardown_appcontext
+    if db.session.in_transaction():
+        db.session.rollback()
     return jsonify({'error': 'Internal server error'}), 500
 
+app = create_app()
+
 if __name__ == '__main__':
-    # Development mode - run with polling
-    if os.getenv('FLASK_ENV') == 'development' and telegram_bot:
+    init_db(app)
+    
+    with app.app_context():
+        telegram_bot = get_bot()
+    
+    if telegram_bot and BOT_MODE == 'webhook':
+        # Telegram pushes updates to /webhook/telegram
+        telegram_bot.set_webhook(TELEGRAM_WEBHOOK_URL, os.getenv('WEBHOOK_SECRET_TOKEN'))
+    elif telegram_bot and BOT_MODE == 'polling':
         import threading
         
         def run_bot():
-            logger.info("Starting Telegram bot in polling mode")
+            logger.info("Starting Telegram bot in long polling mode")
             telegram_bot.run_polling()
         
         # Start bot in a separate thread
@@ -125,4 +252,3 @@ if __name__ == '__main__':
     
     # Start Flask app
     app.run(host='0.0.0.0', port=int(os.getenv('PORT', 5000)), debug=os.getenv('DEBUG', 'False').lower() == 'true')
-
@@ -1,10 +1,51 @@
+"""Database models.
+
+Relationships default to lazy='raise', so touching an unloaded collection
+raises instead of silently issuing one SELECT per row. Queries that need a
+relationship load it explicitly, e.g. ``options(selectinload(User.credits))``.
+"""
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timezone
-from sqlalchemy import Index
+from sqlalchemy import Index, SmallInteger, func
+from sqlalchemy.types import TypeDecorator
 import enum
 
 db = SQLAlchemy()
 
+def utcnow():
+    """Column default: evaluated per row, not once at import"""
+    return datetime.now(timezone.utc)
+
+class SmallIntEnum(TypeDecorator):
+    """Store an enum member as its declaration index in a SMALLINT column.
+    
+    Codes follow declaration order, so new members must only be appended.
+    """
+    impl = SmallInteger
+    cache_ok = True
+    
+    def __init__(self, enum_class, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.enum_class = enum_class
+        self._members = list(enum_class)
+        self._codes = {member: code for code, member in enumerate(self._members)}
+    
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        # Accept raw values too, e.g. filter_by(status='completed')
+        if not isinstance(value, self.enum_class):
+            value = self.enum_class(value)
+        return self._codes[value]
+    
+    def process_literal_param(self, value, dialect):
+        return self.process_bind_param(value, dialect)
+    
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return self._members[value]
+
 class UserStatus(enum.Enum):
     ACTIVE = "active"
     SUSPENDED = "suspended"
@@ -75,31 +116,49 @@ class User(db.Model):
     last_name = db.Column(db.String(255))
     language_code = db.Column(db.String(10), default='en')
     is_premium = db.Column(db.Boolean, default=False)
-    status = db.Column(db.Enum(UserStatus), default=UserStatus.ACTIVE)
-    registration_date = db.Column(db.DateTime(timezone=True), default=datetime.now(timezone.utc))
-    last_activity = db.Column(db.DateTime(timezone=True), default=datetime.now(timezone.utc))
+    status = db.Column(SmallIntEnum(UserStatus), default=UserStatus.ACTIVE)
+    registration_date = db.Column(db.DateTime(timezone=True), default=utcnow)
+    last_activity = db.Column(db.DateTime(timezone=True), default=utcnow)
     total_credits_earned = db.Column(db.Integer, default=1)
     total_credits_spent = db.Column(db.Integer, default=0)
     total_invites_sent = db.Column(db.Integer, default=0)
     total_invites_accepted = db.Column(db.Integer, default=0)
     agreed_to_terms = db.Column(db.Boolean, default=False)
     terms_agreed_at = db.Column(db.DateTime(timezone=True))
-    created_at = db.Column(db.DateTime(timezone=True), default=datetime.now(timezone.utc))
-    updated_at = db.Column(db.DateTime(timezone=True), default=datetime.now(timezone.utc), onupdate=datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime(timezone=True), default=utcnow)
+    updated_at = db.Column(db.DateTime(timezone=True), default=utcnow, onupdate=utcnow)
     
-    # Relationships
-    credits = db.relationship('Credit', backref='user', lazy=True, cascade='all, delete-orphan')
-    transactions = db.relationship('Transaction', backref='user', lazy=True, cascade='all, delete-orphan')
-    face_swap_jobs = db.relationship('FaceSwapJob', backref='user', lazy=True, cascade='all, delete-orphan')
-    sent_invites = db.relationship('Invite', foreign_keys='Invite.inviter_user_id', backref='inviter', lazy=True)
-    received_invites = db.relationship('Invite', foreign_keys='Invite.invitee_user_id', backref='invitee', lazy=True)
+    # Relationships (lazy='raise': eager-load explicitly where needed)
+    credits = db.relationship('Credit', back_populates='user', lazy='raise', cascade='all, delete-orphan')
+    transactions = db.relationship('Transaction', back_populates='user', lazy='raise', cascade='all, delete-orphan')
+    face_swap_jobs = db.relationship('FaceSwapJob', back_populates='user', lazy='raise', cascade='all, delete-orphan')
+    sent_invites = db.relationship('Invite', foreign_keys='Invite.inviter_user_id', back_populates='inviter', lazy='raise')
+    received_invites = db.relationship('Invite', foreign_keys='Invite.invitee_user_id', back_populates='invitee', lazy='raise')
     
     def __repr__(self):
         return f'<User {self.telegram_user_id}>'
     
     def get_active_credits(self):
         """Get total active credits for the user"""
-        return sum(credit.balance for credit in self.credits if credit.is_active)
+        return db.session.query(func.coalesce(func.sum(Credit.balance), 0)).filter(
+            Credit.user_id == self.id,
+            Credit.is_active == True
+        ).scalar()
+    
+    @classmethod
+    def active_credits_for(cls, user_ids) -> dict:
+        """Get total active credits for several users in one query"""
+        if not user_ids:
+            return {}
+        
+        rows = db.session.query(Credit.user_id, func.sum(Credit.balance)).filter(
+            Credit.user_id.in_(user_ids),
+            Credit.is_active == True
+        ).group_by(Credit.user_id).all()
+        
+        balances = {user_id: 0 for user_id in user_ids}
+        balances.update({user_id: total or 0 for user_id, total in rows})
+        return balances
     
     def can_perform_job(self):
         """Check if user has enough credits to perform a face swap job"""
@@ -110,15 +169,19 @@ class Credit(db.Model):
     
     id = db.Column(db.BigInteger, primary_key=True)
     user_id = db.Column(db.BigInteger, db.ForeignKey('users.id'), nullable=False)
-    credit_type = db.Column(db.Enum(CreditType), nullable=False)
+    credit_type = db.Column(SmallIntEnum(CreditType), nullable=False)
     amount = db.Column(db.Integer, nullable=False)
     balance = db.Column(db.Integer, nullable=False, default=0)
     source = db.Column(db.Enum(CreditSource), nullable=False)
     source_reference = db.Column(db.String(255))
+    source_actor_id = db.Column(db.BigInteger)  # admin or user behind a grant/transfer
+    source_reason = db.Column(db.String(255))
     expires_at = db.Column(db.DateTime(timezone=True))
     is_active = db.Column(db.Boolean, default=True)
-    created_at = db.Column(db.DateTime(timezone=True), default=datetime.now(timezone.utc))
-    updated_at = db.Column(db.DateTime(timezone=True), default=datetime.now(timezone.utc), onupdate=datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime(timezone=True), default=utcnow)
+    updated_at = db.Column(db.DateTime(timezone=True), default=utcnow, onupdate=utcnow)
+    
+    user = db.relationship('User', back_populates='credits', lazy='raise')
     
     def __repr__(self):
         return f'<Credit {self.id}: {self.balance}/{self.amount}>'
@@ -135,10 +198,12 @@ class Transaction(db.Model):
     credits_purchased = db.Column(db.Integer, nullable=False)
     external_transaction_id = db.Column(db.String(255), unique=True)
     payment_gateway_response = db.Column(db.JSON)
-    status = db.Column(db.Enum(TransactionStatus), default=TransactionStatus.PENDING)
+    status = db.Column(SmallIntEnum(TransactionStatus), default=TransactionStatus.PENDING)
     processed_at = db.Column(db.DateTime(timezone=True))
-    created_at = db.Column(db.DateTime(timezone=True), default=datetime.now(timezone.utc))
-    updated_at = db.Column(db.DateTime(timezone=True), default=datetime.now(timezone.utc), onupdate=datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime(timezone=True), default=utcnow)
+    updated_at = db.Column(db.DateTime(timezone=True), default=utcnow, onupdate=utcnow)
+    
+    user = db.relationship('User', back_populates='transactions', lazy='raise')
     
     def __repr__(self):
         return f'<Transaction {self.id}: {self.credits_purchased} credits>'
@@ -149,7 +214,7 @@ class FaceSwapJob(db.Model):
     id = db.Column(db.BigInteger, primary_key=True)
     user_id = db.Column(db.BigInteger, db.ForeignKey('users.id'), nullable=False)
     job_type = db.Column(db.Enum(JobType), nullable=False)
-    status = db.Column(db.Enum(JobStatus), default=JobStatus.QUEUED)
+    status = db.Column(SmallIntEnum(JobStatus), default=JobStatus.QUEUED)
     credits_consumed = db.Column(db.Integer, default=1)
     source_file_path = db.Column(db.String(500))
     target_file_path = db.Column(db.String(500))
@@ -161,8 +226,10 @@ class FaceSwapJob(db.Model):
     telegram_message_id = db.Column(db.BigInteger)
     started_at = db.Column(db.DateTime(timezone=True))
     completed_at = db.Column(db.DateTime(timezone=True))
-    created_at = db.Column(db.DateTime(timezone=True), default=datetime.now(timezone.utc))
-    updated_at = db.Column(db.DateTime(timezone=True), default=datetime.now(timezone.utc), onupdate=datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime(timezone=True), default=utcnow)
+    updated_at = db.Column(db.DateTime(timezone=True), default=utcnow, onupdate=utcnow)
+    
+    user = db.relationship('User', back_populates='face_swap_jobs', lazy='raise')
     
     def __repr__(self):
         return f'<FaceSwapJob {self.id}: {self.status.value}>'
@@ -176,11 +243,14 @@ class Invite(db.Model):
     invite_code = db.Column(db.String(50), unique=True, nullable=False)
     status = db.Column(db.Enum(InviteStatus), default=InviteStatus.PENDING)
     credits_awarded = db.Column(db.Integer, default=1)
-    invited_at = db.Column(db.DateTime(timezone=True), default=datetime.now(timezone.utc))
+    invited_at = db.Column(db.DateTime(timezone=True), default=utcnow)
     accepted_at = db.Column(db.DateTime(timezone=True))
     expires_at = db.Column(db.DateTime(timezone=True))
-    created_at = db.Column(db.DateTime(timezone=True), default=datetime.now(timezone.utc))
-    updated_at = db.Column(db.DateTime(timezone=True), default=datetime.now(timezone.utc), onupdate=datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime(timezone=True), default=utcnow)
+    updated_at = db.Column(db.DateTime(timezone=True), default=utcnow, onupdate=utcnow)
+    
+    inviter = db.relationship('User', foreign_keys=[inviter_user_id], back_populates='sent_invites', lazy='raise')
+    invitee = db.relationship('User', foreign_keys=[invitee_user_id], back_populates='received_invites', lazy='raise')
     
     def __repr__(self):
         return f'<Invite {self.invite_code}: {self.status.value}>'
@@ -197,8 +267,8 @@ class AdminUser(db.Model):
     last_login = db.Column(db.DateTime(timezone=True))
     failed_login_attempts = db.Column(db.Integer, default=0)
     locked_until = db.Column(db.DateTime(timezone=True))
-    created_at = db.Column(db.DateTime(timezone=True), default=datetime.now(timezone.utc))
-    updated_at = db.Column(db.DateTime(timezone=True), default=datetime.now(timezone.utc), onupdate=datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime(timezone=True), default=utcnow)
+    updated_at = db.Column(db.DateTime(timezone=True), default=utcnow, onupdate=utcnow)
     
     def __repr__(self):
         return f'<AdminUser {self.username}>'
@@ -213,8 +283,8 @@ class SystemConfiguration(db.Model):
     description = db.Column(db.Text)
     is_sensitive = db.Column(db.Boolean, default=False)
     updated_by = db.Column(db.BigInteger, db.ForeignKey('admin_users.id'))
-    created_at = db.Column(db.DateTime(timezone=True), default=datetime.now(timezone.utc))
-    updated_at = db.Column(db.DateTime(timezone=True), default=datetime.now(timezone.utc), onupdate=datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime(timezone=True), default=utcnow)
+    updated_at = db.Column(db.DateTime(timezone=True), default=utcnow, onupdate=utcnow)
     
     def __repr__(self):
         return f'<SystemConfiguration {self.config_key}>'
@@ -232,17 +302,45 @@ class AuditLog(db.Model):
     new_values = db.Column(db.JSON)
     ip_address = db.Column(db.String(45))  # IPv6 compatible
     user_agent = db.Column(db.Text)
-    created_at = db.Column(db.DateTime(timezone=True), default=datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime(timezone=True), default=utcnow)
     
     def __repr__(self):
         return f'<AuditLog {self.id}: {self.action}>'
 
 # Create indexes for performance optimization
 Index('idx_users_telegram_id', User.telegram_user_id)
-Index('idx_users_status', User.status)
+Index('idx_users_status_registered', User.status, User.registration_date.desc())
 Index('idx_credits_user_active_type', Credit.user_id, Credit.is_active, Credit.credit_type)
+Index('idx_credits_user_created', Credit.user_id, Credit.created_at.desc(), Credit.id.desc())
+Index('idx_credits_source_actor', Credit.source_actor_id)
 Index('idx_transactions_user_status', Transaction.user_id, Transaction.status)
+Index('idx_transactions_created_at', Transaction.created_at.desc())
 Index('idx_face_swap_jobs_user_status', FaceSwapJob.user_id, FaceSwapJob.status)
+Index('idx_face_swap_jobs_status', FaceSwapJob.status)
+Index('idx_face_swap_jobs_user_created', FaceSwapJob.user_id, FaceSwapJob.created_at.desc())
 Index('idx_invites_code', Invite.invite_code)
+Index('idx_invites_inviter_status', Invite.inviter_user_id, Invite.status)
 Index('idx_audit_logs_user_action', AuditLog.user_id, AuditLog.action)
 
+
+# Partial indexes: only the rows the queue/expiry scans care about
+Index('idx_face_swap_jobs_queued', FaceSwapJob.created_at,
+      postgresql_where=FaceSwapJob.status == JobStatus.QUEUED,
+      sqlite_where=FaceSwapJob.status == JobStatus.QUEUED)
+Index('idx_invites_pending_expires', Invite.expires_at,
+      postgresql_where=Invite.status == InviteStatus.PENDING,
+      sqlite_where=Invite.status == InviteStatus.PENDING)
+Index('idx_credits_user_active_created', Credit.user_id, Credit.created_at,
+      postgresql_where=Credit.is_active == True,
+      sqlite_where=Credit.is_active == True)
+Index('idx_credits_active_expires', Credit.expires_at,
+      postgresql_where=Credit.is_active == True,
+      sqlite_where=Credit.is_active == True)
+
+# Covering index for active-balance sums (index-only scan). SQLite has no
+# INCLUDE, so there balance is appended to the key instead.
+Index('idx_credits_user_active_covering', Credit.user_id,
+      postgresql_include=['balance'],
+      postgresql_where=Credit.is_active == True).ddl_if(dialect='postgresql')
+Index('idx_credits_user_active_covering_sqlite', Credit.user_id, Credit.balance,
+      sqlite_where=Credit.is_active == True).ddl_if(dialect='sqlite')
@@ -1,601 +1,384 @@
-from flask import Blueprint, request, jsonify, render_template_string
-from src.models.database import db, User, Credit, Transaction, FaceSwapJob, Invite, AdminUser
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
+from src.models.database import db, User, Credit, Transaction, UserStatus
+from sqlalchemy import select
 from src.services.user_service import UserService
 from src.services.credit_service import CreditService
 from src.services.invite_service import InviteService
+from src.services.stats_service import StatsService
+from src.services.audit_service import record_audit
+from src.services.cache import cache
+from datetime import datetime, timezone
 from functools import wraps
+from itsdangerous import BadSignature, TimestampSigner
+from typing import Annotated, Optional
+from werkzeug.exceptions import HTTPException
+import gzip
+import hashlib
+import hmac
+import logging
+import msgspec
 import os
 
 admin_bp = Blueprint('admin', __name__)
+logger = logging.getLogger(__name__)
+
+# Request bodies, validated while decoding straight from the raw bytes
+PositiveInt = Annotated[int, msgspec.Meta(gt=0)]
+
+class GrantCreditsBody(msgspec.Struct):
+    amount: PositiveInt
+    user_id: Optional[PositiveInt] = None
+    user_ids: Optional[list[PositiveInt]] = None
+    reason: str = 'Admin grant'
+
+class UserActionBody(msgspec.Struct):
+    user_id: PositiveInt
+    reason: str = 'Admin action'
+
+def parse_body(body_type):
+    """Decode and validate the JSON request body as body_type"""
+    return msgspec.json.decode(request.get_data(cache=False), type=body_type)
+
+@admin_bp.errorhandler(msgspec.ValidationError)
+@admin_bp.errorhandler(msgspec.DecodeError)
+def handle_bad_request(e):
+    """Malformed or invalid JSON bodies (missing fields, wrong types)"""
+    return jsonify({'error': f'Invalid request: {e}'}), 400
+
+@admin_bp.errorhandler(Exception)
+def handle_error(e):
+    """Single error path for every admin view"""
+    if isinstance(e, HTTPException):
+        return e
+    
+    logger.exception(f"Error in admin endpoint {request.path}")
+    if db.session.in_transaction():
+        db.session.rollback()
+    return jsonify({'error': str(e)}), 500
+
+# Expected Authorization header, built once at import
+_EXPECTED_AUTH = f"Bearer {os.getenv('ADMIN_API_KEY', 'admin_secret')}".encode()
+MAX_ADMIN_BODY_BYTES = 64 * 1024
 
 # Simple authentication decorator (in production, use proper JWT or session management)
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         # Simple authentication check - in production, implement proper auth
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or auth_header != f"Bearer {os.getenv('ADMIN_API_KEY', 'admin_secret')}":
+        auth_header = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(auth_header.encode(), _EXPECTED_AUTH):
             return jsonify({'error': 'Unauthorized'}), 401
+        if request.content_length and request.content_length > MAX_ADMIN_BODY_BYTES:
+            return jsonify({'error': 'Payload too large'}), 413
         return f(*args, **kwargs)
     return decorated_function
 
 user_service = UserService()
 credit_service = CreditService()
 invite_service = InviteService()
+stats_service = StatsService()
+
+# Dashboard endpoints are polled; serve them from a short-lived cache, with
+# the last good payload kept a while longer as a fallback on errors
+ADMIN_CACHE_TTL = 5
+ADMIN_STALE_TTL = 3600
+
+# Page sizes for the list endpoints (also bounds the distinct cache keys)
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def page_args():
+    """limit/offset query args, clamped to sane bounds"""
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    offset = request.args.get('offset', 0, type=int)
+    return min(max(limit, 1), MAX_PAGE_SIZE), max(offset, 0)
+
+def cached_json(key, build):
+    """Return build() as JSON, cached for ADMIN_CACHE_TTL seconds with a stale fallback on errors"""
+    payload, cache_status = cached_payload(key, build)
+    return _json_payload(payload, cache_status)
+
+def cached_payload(key, build):
+    """Get the cached JSON bytes for key, rebuilding them when expired"""
+    payload = cache.get(key)
+    if payload is not None:
+        return payload, 'hit'
+    
+    try:
+        payload = current_app.json.dumps(build()).encode()
+    except Exception as e:
+        db.session.rollback()
+        payload = cache.get(f'{key}:stale')
+        if payload is None:
+            raise
+        logger.warning(f"Serving stale {key}: {e}")
+        return payload, 'stale'
+    
+    cache.set(key, payload, ADMIN_CACHE_TTL)
+    cache.set(f'{key}:stale', payload, ADMIN_STALE_TTL)
+    return payload, 'miss'
+
+def _json_payload(payload, cache_status):
+    response = Response(payload, mimetype='application/json')
+    response.headers['X-Cache'] = cache_status
+    return response
+
+# The dashboard page is fully static (data comes from /admin/api), so its
+# bytes, gzip body and ETag are computed once at import
+_DASHBOARD_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates', 'admin_dashboard.html')
+with open(_DASHBOARD_PATH, 'rb') as _f:
+    _DASHBOARD_HTML = _f.read()
+_DASHBOARD_HTML_GZ = gzip.compress(_DASHBOARD_HTML, 6)
+_DASHBOARD_ETAG = hashlib.md5(_DASHBOARD_HTML).hexdigest()
 
 @admin_bp.route('/')
 def admin_dashboard():
     """Admin dashboard HTML page"""
-    dashboard_html = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Telegram Face Swap Bot - Admin Dashboard</title>
-    <style>
-        body { font-family: Arial, sans-serif; margin: 0; padding: 20px; background-color: #f5f5f5; }
-        .container { max-width: 1200px; margin: 0 auto; }
-        .header { background: #2c3e50; color: white; padding: 20px; border-radius: 8px; margin-bottom: 20px; }
-        .stats-grid { display: grid; grid-template-columns: repeat(auto-fit, minmax(250px, 1fr)); gap: 20px; margin-bottom: 20px; }
-        .stat-card { background: white; padding: 20px; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }
-        .stat-number { font-size: 2em; font-weight: bold; color: #3498db; }
-        .stat-label { color: #7f8c8d; margin-top: 5px; }
-        .section { background: white; padding: 20px; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); margin-bottom: 20px; }
-        .section h2 { margin-top: 0; color: #2c3e50; }
-        .btn { background: #3498db; color: white; padding: 10px 20px; border: none; border-radius: 4px; cursor: pointer; margin: 5px; }
-        .btn:hover { background: #2980b9; }
-        .btn-danger { background: #e74c3c; }
-        .btn-danger:hover { background: #c0392b; }
-        .table { width: 100%; border-collapse: collapse; margin-top: 10px; }
-        .table th, .table td { padding: 12px; text-align: left; border-bottom: 1px solid #ddd; }
-        .table th { background-color: #f8f9fa; }
-        .status-active { color: #27ae60; font-weight: bold; }
-        .status-suspended { color: #f39c12; font-weight: bold; }
-        .status-banned { color: #e74c3c; font-weight: bold; }
-        .loading { text-align: center; padding: 20px; color: #7f8c8d; }
-        .error { color: #e74c3c; padding: 10px; background: #fdf2f2; border-radius: 4px; margin: 10px 0; }
-        .success { color: #27ae60; padding: 10px; background: #f0f9f0; border-radius: 4px; margin: 10px 0; }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="header">
-            <h1>🤖 Telegram Face Swap Bot - Admin Dashboard</h1>
-            <p>Monitor and manage your bot's operations</p>
-        </div>
-
-        <div class="stats-grid" id="statsGrid">
-            <div class="loading">Loading statistics...</div>
-        </div>
-
-        <div class="section">
-            <h2>📊 System Overview</h2>
-            <button class="btn" onclick="refreshStats()">🔄 Refresh Stats</button>
-            <button class="btn" onclick="exportData()">📥 Export Data</button>
-            <button class="btn btn-danger" onclick="cleanupExpired()">🧹 Cleanup Expired</button>
-        </div>
-
-        <div class="section">
-            <h2>👥 Recent Users</h2>
-            <div id="recentUsers">
-                <div class="loading">Loading users...</div>
-            </div>
-        </div>
-
-        <div class="section">
-            <h2>💳 Recent Transactions</h2>
-            <div id="recentTransactions">
-                <div class="loading">Loading transactions...</div>
-            </div>
-        </div>
-
-        <div class="section">
-            <h2>🔧 Admin Actions</h2>
-            <div style="display: grid; grid-template-columns: repeat(auto-fit, minmax(300px, 1fr)); gap: 20px;">
-                <div>
-                    <h3>Grant Credits</h3>
-                    <input type="number" id="grantUserId" placeholder="User ID" style="width: 100%; padding: 8px; margin: 5px 0;">
-                    <input type="number" id="grantAmount" placeholder="Credit Amount" style="width: 100%; padding: 8px; margin: 5px 0;">
-                    <input type="text" id="grantReason" placeholder="Reason" style="width: 100%; padding: 8px; margin: 5px 0;">
-                    <button class="btn" onclick="grantCredits()">Grant Credits</button>
-                </div>
-                <div>
-                    <h3>User Management</h3>
-                    <input type="number" id="manageUserId" placeholder="User ID" style="width: 100%; padding: 8px; margin: 5px 0;">
-                    <button class="btn" onclick="suspendUser()">Suspend User</button>
-                    <button class="btn" onclick="banUser()">Ban User</button>
-                    <button class="btn" onclick="reactivateUser()">Reactivate User</button>
-                </div>
-            </div>
-        </div>
-    </div>
-
-    <script>
-        const API_BASE = '/admin/api';
-        const AUTH_TOKEN = 'Bearer admin_secret'; // In production, implement proper auth
-
-        async function apiCall(endpoint, method = 'GET', data = null) {
-            try {
-                const options = {
-                    method,
-                    headers: {
-                        'Authorization': AUTH_TOKEN,
-                        'Content-Type': 'application/json'
-                    }
-                };
-                
-                if (data) {
-                    options.body = JSON.stringify(data);
-                }
-                
-                const response = await fetch(API_BASE + endpoint, options);
-                const result = await response.json();
-                
-                if (!response.ok) {
-                    throw new Error(result.error || 'API call failed');
-                }
-                
-                return result;
-            } catch (error) {
-                console.error('API call error:', error);
-                showError('Error: ' + error.message);
-                throw error;
-            }
-        }
-
-        function showError(message) {
-            const errorDiv = document.createElement('div');
-            errorDiv.className = 'error';
-            errorDiv.textContent = message;
-            document.body.insertBefore(errorDiv, document.body.firstChild);
-            setTimeout(() => errorDiv.remove(), 5000);
-        }
-
-        function showSuccess(message) {
-            const successDiv = document.createElement('div');
-            successDiv.className = 'success';
-            successDiv.textContent = message;
-            document.body.insertBefore(successDiv, document.body.firstChild);
-            setTimeout(() => successDiv.remove(), 3000);
-        }
-
-        async function loadStats() {
-            try {
-                const stats = await apiCall('/stats');
-                
-                const statsHtml = `
-                    <div class="stat-card">
-                        <div class="stat-number">${stats.users.total}</div>
-                        <div class="stat-label">Total Users</div>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-number">${stats.users.active}</div>
-                        <div class="stat-label">Active Users</div>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-number">${stats.credits.total_issued}</div>
-                        <div class="stat-label">Credits Issued</div>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-number">${stats.credits.total_active}</div>
-                        <div class="stat-label">Active Credits</div>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-number">${stats.invites.total_invites}</div>
-                        <div class="stat-label">Total Invites</div>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-number">${stats.invites.accepted_invites}</div>
-                        <div class="stat-label">Accepted Invites</div>
-                    </div>
-                `;
-                
-                document.getElementById('statsGrid').innerHTML = statsHtml;
-            } catch (error) {
-                document.getElementById('statsGrid').innerHTML = '<div class="error">Failed to load statistics</div>';
-            }
-        }
-
-        async function loadRecentUsers() {
-            try {
-                const users = await apiCall('/users?limit=10');
-                
-                let usersHtml = `
-                    <table class="table">
-                        <thead>
-                            <tr>
-                                <th>ID</th>
-                                <th>Name</th>
-                                <th>Username</th>
-                                <th>Status</th>
-                                <th>Credits</th>
-                                <th>Registered</th>
-                            </tr>
-                        </thead>
-                        <tbody>
-                `;
-                
-                users.forEach(user => {
-                    usersHtml += `
-                        <tr>
-                            <td>${user.telegram_user_id}</td>
-                            <td>${user.first_name || 'N/A'}</td>
-                            <td>@${user.username || 'N/A'}</td>
-                            <td><span class="status-${user.status}">${user.status}</span></td>
-                            <td>${user.current_credits}</td>
-                            <td>${new Date(user.registration_date).toLocaleDateString()}</td>
-                        </tr>
-                    `;
-                });
-                
-                usersHtml += '</tbody></table>';
-                document.getElementById('recentUsers').innerHTML = usersHtml;
-            } catch (error) {
-                document.getElementById('recentUsers').innerHTML = '<div class="error">Failed to load users</div>';
-            }
-        }
-
-        async function loadRecentTransactions() {
-            try {
-                const transactions = await apiCall('/transactions?limit=10');
-                
-                let transactionsHtml = `
-                    <table class="table">
-                        <thead>
-                            <tr>
-                                <th>ID</th>
-                                <th>User</th>
-                                <th>Type</th>
-                                <th>Amount</th>
-                                <th>Credits</th>
-                                <th>Status</th>
-                                <th>Date</th>
-                            </tr>
-                        </thead>
-                        <tbody>
-                `;
-                
-                transactions.forEach(tx => {
-                    transactionsHtml += `
-                        <tr>
-                            <td>${tx.id}</td>
-                            <td>${tx.user_id}</td>
-                            <td>${tx.transaction_type}</td>
-                            <td>${tx.amount_local} ${tx.currency_code}</td>
-                            <td>${tx.credits_purchased}</td>
-                            <td>${tx.status}</td>
-                            <td>${new Date(tx.created_at).toLocaleDateString()}</td>
-                        </tr>
-                    `;
-                });
-                
-                transactionsHtml += '</tbody></table>';
-                document.getElementById('recentTransactions').innerHTML = transactionsHtml;
-            } catch (error) {
-                document.getElementById('recentTransactions').innerHTML = '<div class="error">Failed to load transactions</div>';
-            }
-        }
-
-        async function grantCredits() {
-            const userId = document.getElementById('grantUserId').value;
-            const amount = document.getElementById('grantAmount').value;
-            const reason = document.getElementById('grantReason').value;
-            
-            if (!userId || !amount) {
-                showError('Please fill in User ID and Amount');
-                return;
-            }
-            
-            try {
-                await apiCall('/grant-credits', 'POST', {
-                    user_id: parseInt(userId),
-                    amount: parseInt(amount),
-                    reason: reason
-                });
-                
-                showSuccess(`Granted ${amount} credits to user ${userId}`);
-                document.getElementById('grantUserId').value = '';
-                document.getElementById('grantAmount').value = '';
-                document.getElementById('grantReason').value = '';
-                refreshStats();
-            } catch (error) {
-                // Error already shown by apiCall
-            }
-        }
-
-        async function suspendUser() {
-            const userId = document.getElementById('manageUserId').value;
-            if (!userId) {
-                showError('Please enter User ID');
-                return;
-            }
-            
-            try {
-                await apiCall('/suspend-user', 'POST', { user_id: parseInt(userId) });
-                showSuccess(`User ${userId} suspended`);
-                loadRecentUsers();
-            } catch (error) {
-                // Error already shown by apiCall
-            }
-        }
-
-        async function banUser() {
-            const userId = document.getElementById('manageUserId').value;
-            if (!userId) {
-                showError('Please enter User ID');
-                return;
-            }
-            
-            try {
-                await apiCall('/ban-user', 'POST', { user_id: parseInt(userId) });
-                showSuccess(`User ${userId} banned`);
-                loadRecentUsers();
-            } catch (error) {
-                // Error already shown by apiCall
-            }
-        }
-
-        async function reactivateUser() {
-            const userId = document.getElementById('manageUserId').value;
-            if (!userId) {
-                showError('Please enter User ID');
-                return;
-            }
-            
-            try {
-                await apiCall('/reactivate-user', 'POST', { user_id: parseInt(userId) });
-                showSuccess(`User ${userId} reactivated`);
-                loadRecentUsers();
-            } catch (error) {
-                // Error already shown by apiCall
-            }
-        }
-
-        async function refreshStats() {
-            await Promise.all([loadStats(), loadRecentUsers(), loadRecentTransactions()]);
-            showSuccess('Statistics refreshed');
-        }
-
-        async function exportData() {
-            try {
-                const response = await fetch(API_BASE + '/export', {
-                    headers: { 'Authorization': AUTH_TOKEN }
-                });
-                const blob = await response.blob();
-                const url = window.URL.createObjectURL(blob);
-                const a = document.createElement('a');
-                a.href = url;
-                a.download = 'bot_data_export.json';
-                a.click();
-                showSuccess('Data exported successfully');
-            } catch (error) {
-                showError('Export failed: ' + error.message);
-            }
-        }
-
-        async function cleanupExpired() {
-            try {
-                const result = await apiCall('/cleanup', 'POST');
-                showSuccess(`Cleanup completed: ${result.expired_credits} credits, ${result.expired_invites} invites`);
-                refreshStats();
-            } catch (error) {
-                // Error already shown by apiCall
-            }
-        }
-
-        // Load initial data
-        document.addEventListener('DOMContentLoaded', () => {
-            refreshStats();
-        });
-    </script>
-</body>
-</html>
-    """
-    return render_template_string(dashboard_html)
+    if request.if_none_match.contains(_DASHBOARD_ETAG):
+        response = Response(status=304)
+    elif 'gzip' in request.accept_encodings:
+        response = Response(_DASHBOARD_HTML_GZ, mimetype='text/html')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(_DASHBOARD_HTML, mimetype='text/html')
+    
+    response.set_etag(_DASHBOARD_ETAG)
+    response.headers['Cache-Control'] = 'public, max-age=60'
+    response.vary.add('Accept-Encoding')
+    return response
 
 @admin_bp.route('/api/stats')
 @admin_required
 def get_stats():
     """Get system statistics"""
+    return cached_json('admin:stats:v1', stats_service.get_dashboard_stats)
+
+# The stats stream (/admin/api/stream, served by src/asgi.py off the WSGI
+# threads) is authorized by a short-lived signed cookie, since EventSource
+# cannot send the Authorization header and the API key must not end up in URLs
+STATS_STREAM_COOKIE = 'admin_stream'
+STATS_STREAM_COOKIE_MAX_AGE = 3600
+
+def _stats_stream_signer(secret_key) -> TimestampSigner:
+    return TimestampSigner(secret_key, salt='admin-stats-stream')
+
+def stats_stream_cookie_valid(secret_key, value: str) -> bool:
+    """Whether value is an unexpired stats stream cookie"""
     try:
-        user_stats = user_service.get_user_count()
-        credit_stats = credit_service.get_credit_statistics()
-        invite_stats = invite_service.get_invite_statistics()
-        
-        # Get job statistics
-        total_jobs = FaceSwapJob.query.count()
-        completed_jobs = FaceSwapJob.query.filter_by(status='completed').count()
-        
-        return jsonify({
-            'users': user_stats,
-            'credits': credit_stats,
-            'invites': invite_stats,
-            'jobs': {
-                'total': total_jobs,
-                'completed': completed_jobs,
-                'success_rate': (completed_jobs / total_jobs * 100) if total_jobs > 0 else 0
-            }
-        })
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        _stats_stream_signer(secret_key).unsign(value, max_age=STATS_STREAM_COOKIE_MAX_AGE)
+        return True
+    except BadSignature:
+        return False
+
+@admin_bp.route('/api/stream-session', methods=['POST'])
+@admin_required
+def stats_stream_session():
+    """Issue the cookie that authorizes the stats stream"""
+    response = jsonify({'success': True, 'expires_in': STATS_STREAM_COOKIE_MAX_AGE})
+    response.set_cookie(
+        STATS_STREAM_COOKIE,
+        _stats_stream_signer(current_app.config['SECRET_KEY']).sign(b'admin').decode(),
+        max_age=STATS_STREAM_COOKIE_MAX_AGE,
+        path='/admin/api/stream',
+        secure=request.is_secure,
+        httponly=True,
+        samesite='Strict'
+    )
+    return response
 
 @admin_bp.route('/api/users')
 @admin_required
 def get_users():
     """Get users list"""
-    try:
-        limit = int(request.args.get('limit', 50))
-        offset = int(request.args.get('offset', 0))
-        status = request.args.get('status')
-        
-        users = user_service.search_users(limit=limit, offset=offset)
-        
-        users_data = []
-        for user in users:
-            user_stats = user_service.get_user_stats(user.id)
-            users_data.append(user_stats)
-        
-        return jsonify(users_data)
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    limit, offset = page_args()
+    status = request.args.get('status')
+    
+    if status:
+        try:
+            status = UserStatus(status)
+        except ValueError:
+            return jsonify({'error': f'Invalid status: {status}'}), 400
+    
+    return cached_json(
+        f"admin:users:v1:{limit}:{offset}:{status.value if status else ''}",
+        lambda: user_service.get_users_with_stats(limit=limit, offset=offset, status=status)
+    )
 
 @admin_bp.route('/api/transactions')
 @admin_required
 def get_transactions():
     """Get transactions list"""
-    try:
-        limit = int(request.args.get('limit', 50))
-        offset = int(request.args.get('offset', 0))
-        
-        transactions = Transaction.query.order_by(
-            Transaction.created_at.desc()
-        ).offset(offset).limit(limit).all()
-        
-        transactions_data = []
-        for tx in transactions:
-            transactions_data.append({
-                'id': tx.id,
-                'user_id': tx.user_id,
-                'transaction_type': tx.transaction_type.value,
-                'payment_method': tx.payment_method.value,
-                'amount_local': float(tx.amount_local),
-                'currency_code': tx.currency_code,
-                'credits_purchased': tx.credits_purchased,
-                'status': tx.status.value,
-                'created_at': tx.created_at.isoformat()
-            })
-        
-        return jsonify(transactions_data)
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    limit, offset = page_args()
+    
+    return cached_json(
+        f'admin:transactions:v1:{limit}:{offset}',
+        lambda: list_transactions(limit, offset)
+    )
+
+def list_transactions(limit: int, offset: int) -> list:
+    """Get the latest transactions shaped for the dashboard"""
+    # Select only the serialized columns; no ORM objects are hydrated
+    rows = db.session.execute(
+        select(
+            Transaction.id,
+            Transaction.user_id,
+            Transaction.transaction_type,
+            Transaction.payment_method,
+            Transaction.amount_local,
+            Transaction.currency_code,
+            Transaction.credits_purchased,
+            Transaction.status,
+            Transaction.created_at
+        ).order_by(Transaction.created_at.desc()).offset(offset).limit(limit)
+    ).mappings().all()
+    
+    # Enums, Decimals and datetimes are encoded by the app's JSON provider
+    return [dict(tx) for tx in rows]
 
 @admin_bp.route('/api/grant-credits', methods=['POST'])
 @admin_required
 def grant_credits():
     """Grant credits to a user"""
-    try:
-        data = request.get_json()
-        user_id = data.get('user_id')
-        amount = data.get('amount')
-        reason = data.get('reason', 'Admin grant')
-        
-        if not user_id or not amount:
-            return jsonify({'error': 'user_id and amount are required'}), 400
-        
-        credit = credit_service.grant_admin_credits(
-            user_id=user_id,
+    body = parse_body(GrantCreditsBody)
+    user_id, user_ids, amount, reason = body.user_id, body.user_ids, body.amount, body.reason
+    
+    if not (user_id or user_ids):
+        return jsonify({'error': 'user_id (or user_ids) is required'}), 400
+    
+    # Bulk grant: one multi-row INSERT instead of one per user
+    if user_ids:
+        granted = credit_service.grant_admin_credits_bulk(
+            user_ids=user_ids,
             amount=amount,
             admin_id=1,  # In production, get from authenticated admin
             reason=reason
         )
+        for target_id in user_ids:
+            record_audit('grant_credits', 'user', entity_id=target_id, user_id=target_id,
+                         new_values={'amount': amount, 'reason': reason})
         
         return jsonify({
             'success': True,
-            'credit_id': credit.id,
-            'message': f'Granted {amount} credits to user {user_id}'
+            'granted': granted,
+            'message': f'Granted {amount} credits to {granted} users'
         })
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    
+    credit = credit_service.grant_admin_credits(
+        user_id=user_id,
+        amount=amount,
+        admin_id=1,  # In production, get from authenticated admin
+        reason=reason
+    )
+    record_audit('grant_credits', 'credit', entity_id=credit.id, user_id=user_id,
+                 new_values={'amount': amount, 'reason': reason})
+    
+    return jsonify({
+        'success': True,
+        'credit_id': credit.id,
+        'message': f'Granted {amount} credits to user {user_id}'
+    })
 
 @admin_bp.route('/api/suspend-user', methods=['POST'])
 @admin_required
 def suspend_user():
     """Suspend a user"""
-    try:
-        data = request.get_json()
-        user_id = data.get('user_id')
-        reason = data.get('reason', 'Admin action')
-        
-        if not user_id:
-            return jsonify({'error': 'user_id is required'}), 400
-        
-        success = user_service.suspend_user(user_id, reason)
-        
-        if success:
-            return jsonify({'success': True, 'message': f'User {user_id} suspended'})
-        else:
-            return jsonify({'error': 'User not found'}), 404
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    body = parse_body(UserActionBody)
+    user_id, reason = body.user_id, body.reason
+    
+    success = user_service.suspend_user(user_id, reason)
+    
+    if success:
+        record_audit('suspend_user', 'user', entity_id=user_id, user_id=user_id,
+                     new_values={'status': 'suspended', 'reason': reason})
+        return jsonify({'success': True, 'message': f'User {user_id} suspended'})
+    else:
+        return jsonify({'error': 'User not found'}), 404
 
 @admin_bp.route('/api/ban-user', methods=['POST'])
 @admin_required
 def ban_user():
     """Ban a user"""
-    try:
-        data = request.get_json()
-        user_id = data.get('user_id')
-        reason = data.get('reason', 'Admin action')
-        
-        if not user_id:
-            return jsonify({'error': 'user_id is required'}), 400
-        
-        success = user_service.ban_user(user_id, reason)
-        
-        if success:
-            return jsonify({'success': True, 'message': f'User {user_id} banned'})
-        else:
-            return jsonify({'error': 'User not found'}), 404
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    body = parse_body(UserActionBody)
+    user_id, reason = body.user_id, body.reason
+    
+    success = user_service.ban_user(user_id, reason)
+    
+    if success:
+        record_audit('ban_user', 'user', entity_id=user_id, user_id=user_id,
+                     new_values={'status': 'banned', 'reason': reason})
+        return jsonify({'success': True, 'message': f'User {user_id} banned'})
+    else:
+        return jsonify({'error': 'User not found'}), 404
 
 @admin_bp.route('/api/reactivate-user', methods=['POST'])
 @admin_required
 def reactivate_user():
     """Reactivate a user"""
-    try:
-        data = request.get_json()
-        user_id = data.get('user_id')
-        
-        if not user_id:
-            return jsonify({'error': 'user_id is required'}), 400
-        
-        success = user_service.reactivate_user(user_id)
-        
-        if success:
-            return jsonify({'success': True, 'message': f'User {user_id} reactivated'})
-        else:
-            return jsonify({'error': 'User not found'}), 404
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    user_id = parse_body(UserActionBody).user_id
+    
+    success = user_service.reactivate_user(user_id)
+    
+    if success:
+        record_audit('reactivate_user', 'user', entity_id=user_id, user_id=user_id,
+                     new_values={'status': 'active'})
+        return jsonify({'success': True, 'message': f'User {user_id} reactivated'})
+    else:
+        return jsonify({'error': 'User not found'}), 404
 
 @admin_bp.route('/api/cleanup', methods=['POST'])
 @admin_required
 def cleanup_expired():
     """Cleanup expired credits and invites"""
-    try:
-        expired_credits = credit_service.expire_old_credits()
-        expired_invites = invite_service.expire_old_invites()
-        
-        return jsonify({
-            'success': True,
-            'expired_credits': expired_credits,
-            'expired_invites': expired_invites
-        })
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    expired_credits = credit_service.expire_old_credits()
+    expired_invites = invite_service.expire_old_invites()
+    record_audit('cleanup_expired', 'system',
+                 new_values={'expired_credits': expired_credits, 'expired_invites': expired_invites})
+    
+    return jsonify({
+        'success': True,
+        'expired_credits': expired_credits,
+        'expired_invites': expired_invites
+    })
 
 @admin_bp.route('/api/export')
 @admin_required
 def export_data():
-    """Export system data"""
-    try:
-        # Get summary statistics for export
-        user_stats = user_service.get_user_count()
-        credit_stats = credit_service.get_credit_statistics()
-        invite_stats = invite_service.get_invite_statistics()
-        
-        export_data = {
-            'export_timestamp': db.func.now(),
-            'statistics': {
-                'users': user_stats,
-                'credits': credit_stats,
-                'invites': invite_stats
-            }
-        }
-        
-        return jsonify(export_data)
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
+    """Export system data as newline-delimited JSON, streamed row by row"""
+    # Build the summary up front so errors still produce a 500
+    header = dict(_EXPORT_HEADER,
+                  export_timestamp=datetime.now(timezone.utc),
+                  statistics=stats_service.get_dashboard_stats())
+    
+    response = Response(stream_with_context(_export_lines(header)), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = 'attachment; filename=bot_data_export.jsonl'
+    return response
+
+# Exported tables and columns (only what an export needs, no ORM objects)
+EXPORT_TABLES = {
+    'user': (User.id, User.telegram_user_id, User.username, User.first_name, User.status,
+             User.registration_date, User.last_activity, User.total_credits_earned,
+             User.total_credits_spent, User.total_invites_accepted),
+    'credit': (Credit.id, Credit.user_id, Credit.credit_type, Credit.amount, Credit.balance,
+               Credit.source, Credit.is_active, Credit.expires_at, Credit.created_at),
+    'transaction': (Transaction.id, Transaction.user_id, Transaction.transaction_type,
+                    Transaction.payment_method, Transaction.amount_local, Transaction.currency_code,
+                    Transaction.credits_purchased, Transaction.status, Transaction.created_at)
+}
+EXPORT_BATCH_SIZE = 1000
+
+# Invariant part of the summary line
+_EXPORT_HEADER = {'type': 'summary', 'row_types': list(EXPORT_TABLES)}
+
+def _export_lines(header: dict):
+    dumps = current_app.json.dumps
+    yield dumps(header) + '\n'
+    
+    for row_type, columns in EXPORT_TABLES.items():
+        # yield_per streams from a server-side cursor in fixed-size batches
+        result = db.session.execute(
+            select(*columns).order_by(columns[0]).execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        for row in result.mappings():
+            record = dict(row)
+            record['type'] = row_type
+            yield dumps(record) + '\n'
@@ -0,0 +1,79 @@
+from src.models.database import db
+from src.routes.admin import (
+    STATS_STREAM_COOKIE, cached_payload, stats_service, stats_stream_cookie_valid
+)
+from werkzeug.http import parse_cookie
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Dashboard stats pushed over server-sent events. This is a plain ASGI
+# handler on uvicorn's event loop, so an open dashboard holds no WSGI thread.
+STATS_STREAM_PATH = '/admin/api/stream'
+STATS_STREAM_INTERVAL = 10
+
+# Each response ends after this many ticks (~5 minutes) and EventSource
+# reconnects, so cookie expiry and the stream cap are re-checked regularly
+STATS_STREAM_EVENTS = 30
+MAX_STATS_STREAMS = 10
+
+_open_streams = 0
+
+def _stats_payload(flask_app):
+    """The cached stats JSON, built in a worker thread; None if it can't be built"""
+    with flask_app.app_context():
+        try:
+            payload, _ = cached_payload('admin:stats:v1', stats_service.get_dashboard_stats)
+            return payload
+        except Exception:
+            logger.exception("Error building stats for the admin stream")
+            return None
+        finally:
+            db.session.remove()
+
+async def _send_status(send, status: int):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'text/plain')]})
+    await send({'type': 'http.response.body', 'body': b''})
+
+async def stats_stream(flask_app, scope, receive, send):
+    """Serve /admin/api/stream"""
+    global _open_streams
+    
+    cookies = parse_cookie(b'; '.join(value for name, value in scope['headers'] if name == b'cookie').decode('latin1'))
+    if not stats_stream_cookie_valid(flask_app.config['SECRET_KEY'], cookies.get(STATS_STREAM_COOKIE, '')):
+        await _send_status(send, 401)
+        return
+    if _open_streams >= MAX_STATS_STREAMS:
+        await _send_status(send, 503)
+        return
+    
+    _open_streams += 1
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no')
+        ]})
+        
+        last_payload = None
+        for _ in range(STATS_STREAM_EVENTS):
+            payload = await asyncio.to_thread(_stats_payload, flask_app)
+            if payload is not None and payload != last_payload:
+                message = b'data: ' + payload + b'\n\n'
+                last_payload = payload
+            else:
+                message = b': keep-alive\n\n'
+            await send({'type': 'http.response.body', 'body': message, 'more_body': True})
+            
+            # Sleep until the next tick, or stop early if the client went away
+            try:
+                if (await asyncio.wait_for(receive(), STATS_STREAM_INTERVAL))['type'] == 'http.disconnect':
+                    return
+            except asyncio.TimeoutError:
+                pass
+        
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        _open_streams -= 1
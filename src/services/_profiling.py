@@ -0,0 +1,48 @@
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from sqlalchemy import event
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Requests running more statements than this are logged in development
+QUERY_COUNT_WARN_THRESHOLD = 20
+
+class QueryCounter:
+    """SQL statements seen by count_queries"""
+
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+@contextmanager
+def count_queries(engine):
+    """Count SQL statements the current thread runs on engine inside the block"""
+    counter = QueryCounter()
+    thread_id = threading.get_ident()
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == thread_id:
+            counter.count += 1
+            counter.statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+def log_request_query_counts(app, engine, threshold: int = QUERY_COUNT_WARN_THRESHOLD):
+    """Warn about requests that run more than threshold SQL statements"""
+    @event.listens_for(engine, 'before_cursor_execute')
+    def count_request_query(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            g.query_count = g.get('query_count', 0) + 1
+
+    @app.after_request
+    def report_query_count(response):
+        query_count = g.get('query_count', 0)
+        if query_count > threshold:
+            logger.warning(f"{request.method} {request.path} ran {query_count} SQL statements")
+        return response
@@ -0,0 +1,106 @@
+from flask import request, has_request_context
+from src.models.database import db, AuditLog, utcnow
+from sqlalchemy import insert
+import atexit
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Audit rows are never read on the hot path, so requests only enqueue them
+AUDIT_QUEUE: "queue.Queue[dict]" = queue.Queue(maxsize=10000)
+AUDIT_BATCH_SIZE = 100
+AUDIT_FLUSH_INTERVAL = 1.0
+
+_writer_thread = None
+_writer_lock = threading.Lock()
+
+# Held while a batch is being written, so the shutdown flush waits for the
+# writer's in-flight batch instead of racing it
+_flush_lock = threading.Lock()
+
+def record_audit(action: str, entity_type: str, entity_id: int = None,
+                 user_id: int = None, old_values: dict = None, new_values: dict = None):
+    """Queue an audit log entry for the background writer"""
+    row = {
+        'user_id': user_id,
+        'admin_user_id': None,
+        'action': action,
+        'entity_type': entity_type,
+        'entity_id': entity_id,
+        'old_values': old_values,
+        'new_values': new_values,
+        'ip_address': None,
+        'user_agent': None,
+        'created_at': utcnow()
+    }
+
+    if has_request_context():
+        row['ip_address'] = request.remote_addr
+        row['user_agent'] = request.user_agent.string
+
+    try:
+        AUDIT_QUEUE.put_nowait(row)
+    except queue.Full:
+        logger.warning(f"Audit queue full, dropping {action} entry for {entity_type} {entity_id}")
+
+def start_audit_writer(app):
+    """Start the daemon thread that batch-inserts queued audit entries"""
+    global _writer_thread
+    with _writer_lock:
+        if _writer_thread is None or not _writer_thread.is_alive():
+            if _writer_thread is None:
+                # The writer is a daemon thread, so write what is still
+                # queued on the way out (deploys, worker restarts)
+                atexit.register(flush_audit_queue, app)
+            _writer_thread = threading.Thread(target=_drain_audit, args=(app,),
+                                              name='audit-writer', daemon=True)
+            _writer_thread.start()
+
+def flush_audit_queue(app) -> int:
+    """Write every queued audit entry now; returns how many were written"""
+    with _flush_lock:
+        batch = []
+        while True:
+            try:
+                batch.append(AUDIT_QUEUE.get_nowait())
+            except queue.Empty:
+                break
+        
+        if not batch:
+            return 0
+        if not _write_batch(app, batch):
+            logger.error(f"Dropped {len(batch)} audit log entries at shutdown")
+            return 0
+        return len(batch)
+
+def _drain_audit(app):
+    while True:
+        # Block for the first row, then collect up to a batch or one interval
+        batch = [AUDIT_QUEUE.get()]
+        deadline = time.monotonic() + AUDIT_FLUSH_INTERVAL
+        while len(batch) < AUDIT_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(AUDIT_QUEUE.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        with _flush_lock:
+            _write_batch(app, batch)
+
+def _write_batch(app, batch: list) -> bool:
+    """Insert a batch of audit rows in one statement; returns whether it was written"""
+    with app.app_context():
+        try:
+            db.session.execute(insert(AuditLog), batch)
+            db.session.commit()
+            return True
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error writing {len(batch)} audit log entries: {e}")
+            return False
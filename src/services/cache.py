@@ -0,0 +1,84 @@
+from collections import OrderedDict
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class MemoryCache:
+    """Per-process TTL cache used when Redis is not configured"""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """Get a value, or None if missing or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key: str, value: bytes, ttl: int = None):
+        """Store a value, optionally expiring after ttl seconds"""
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        """Remove a value"""
+        with self._lock:
+            self._data.pop(key, None)
+
+class RedisCache:
+    """Cache shared by all workers through Redis"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key: str):
+        """Get a value, or None if missing or Redis is unreachable"""
+        try:
+            return self.client.get(key)
+        except Exception as e:
+            logger.warning(f"Redis get failed for {key}: {e}")
+            return None
+
+    def set(self, key: str, value: bytes, ttl: int = None):
+        """Store a value, optionally expiring after ttl seconds"""
+        try:
+            if ttl:
+                self.client.setex(key, ttl, value)
+            else:
+                self.client.set(key, value)
+        except Exception as e:
+            logger.warning(f"Redis set failed for {key}: {e}")
+
+    def delete(self, key: str):
+        """Remove a value"""
+        try:
+            self.client.delete(key)
+        except Exception as e:
+            logger.warning(f"Redis delete failed for {key}: {e}")
+
+def _create_cache():
+    redis_url = os.getenv('REDIS_URL')
+    if redis_url:
+        try:
+            import redis
+            return RedisCache(redis.Redis.from_url(redis_url))
+        except ImportError:
+            logger.warning("REDIS_URL is set but redis is not installed, using in-memory cache")
+    return MemoryCache()
+
+cache = _create_cache()
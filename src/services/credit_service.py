@@ -1,10 +1,75 @@
+from contextlib import contextmanager
 from datetime import datetime, timezone, timedelta
-from src.models.database import db, User, Credit, CreditType, CreditSource
-from sqlalchemy import func
+from src.models.database import db, User, UserStatus, Credit, CreditType, CreditSource
+from src.services.cache import cache
+from sqlalchemy import and_, case, event, func, insert, lambda_stmt, select, tuple_, update
+from sqlalchemy.orm import Session
 import logging
+import orjson
 
 logger = logging.getLogger(__name__)
 
+# Active balances are read on every bot interaction; writes below invalidate
+BALANCE_CACHE_TTL = 300
+
+# System-wide stats scan the whole credits table; TTL-only staleness is fine
+CREDIT_STATS_CACHE_KEY = 'credit:stats'
+CREDIT_STATS_CACHE_TTL = 60
+
+# Columns shown in credit history lists (id/created_at double as the page cursor)
+CREDIT_HISTORY_COLUMNS = (
+    Credit.id, Credit.credit_type, Credit.amount, Credit.balance,
+    Credit.source, Credit.is_active, Credit.expires_at, Credit.created_at
+)
+
+# Rows per multi-row INSERT/UPDATE when granting to many users
+BULK_GRANT_BATCH_SIZE = 1000
+
+def _balance_key(user_id: int) -> str:
+    return f"credit:bal:{user_id}"
+
+@contextmanager
+def no_expire_on_commit(session):
+    """Temporarily keep instances loaded across commit()"""
+    previous = session.expire_on_commit
+    session.expire_on_commit = False
+    try:
+        yield session
+    finally:
+        session.expire_on_commit = previous
+
+def invalidate_balances(user_ids):
+    """Drop cached active balances after a committed credit change"""
+    for user_id in user_ids:
+        cache.delete(_balance_key(user_id))
+
+def invalidate_balances_on_commit(user_ids):
+    """Drop cached balances once the caller commits the current transaction"""
+    db.session().info.setdefault('stale_balances', set()).update(user_ids)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_stale_balances(session):
+    user_ids = session.info.pop('stale_balances', None)
+    if user_ids:
+        invalidate_balances(user_ids)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_stale_balances(session):
+    session.info.pop('stale_balances', None)
+
+# Hot-path statements as lambda_stmt: the expression tree and its cache key
+# are built once per call site instead of on every call; user_id is bound
+def _active_balance_stmt(user_id: int):
+    return lambda_stmt(lambda: select(func.sum(Credit.balance)).where(
+        Credit.user_id == user_id, Credit.is_active == True
+    ))
+
+def _fifo_credits_stmt(user_id: int):
+    return lambda_stmt(lambda: select(Credit.id, Credit.balance)
+        .where(Credit.user_id == user_id, Credit.is_active == True, Credit.balance > 0)
+        .order_by(Credit.created_at)
+        .with_for_update())
+
 class CreditService:
     """Service for managing user credits"""
     
@@ -14,16 +79,20 @@ class CreditService:
     
     def get_active_credit_balance(self, user_id: int) -> int:
         """Get total active credit balance for a user"""
-        result = db.session.query(func.sum(Credit.balance)).filter_by(
-            user_id=user_id, 
-            is_active=True
-        ).scalar()
-        return result or 0
+        key = _balance_key(user_id)
+        cached = cache.get(key)
+        if cached is not None:
+            return int(cached)
+        
+        result = db.session.execute(_active_balance_stmt(user_id)).scalar() or 0
+        cache.set(key, str(result).encode(), ttl=BALANCE_CACHE_TTL)
+        return result
     
     def add_credits(self, user_id: int, amount: int, credit_type: CreditType, 
                    source: CreditSource, source_reference: str = None, 
-                   expires_at: datetime = None) -> Credit:
-        """Add credits to a user account"""
+                   expires_at: datetime = None, source_actor_id: int = None,
+                   source_reason: str = None, commit: bool = True) -> Credit:
+        """Add credits to a user account; commit=False leaves committing to the caller"""
         try:
             credit = Credit(
                 user_id=user_id,
@@ -32,83 +101,182 @@ class CreditService:
                 balance=amount,
                 source=source,
                 source_reference=source_reference,
+                source_actor_id=source_actor_id,
+                source_reason=source_reason,
                 expires_at=expires_at
             )
             
             db.session.add(credit)
             
-            # Update user's total credits earned
-            user = User.query.get(user_id)
-            if user:
-                user.total_credits_earned += amount
+            # Update user's total credits earned; 'evaluate' also bumps a User
+            # already loaded in this session, since it is not expired below
+            db.session.execute(
+                update(User)
+                .where(User.id == user_id)
+                .values(total_credits_earned=User.total_credits_earned + amount)
+                .execution_options(synchronize_session='evaluate')
+            )
             
-            db.session.commit()
+            if not commit:
+                db.session.flush()
+                invalidate_balances_on_commit([user_id])
+                return credit
+            
+            # Keep the returned credit loaded so callers reading credit.id
+            # don't trigger a refresh SELECT
+            with no_expire_on_commit(db.session()):
+                db.session.commit()
+            invalidate_balances([user_id])
             logger.info(f"Added {amount} credits to user {user_id} from {source.value}")
             
             return credit
             
         except Exception as e:
-            db.session.rollback()
+            if commit:
+                db.session.rollback()
             logger.error(f"Error adding credits to user {user_id}: {e}")
             raise
     
-    def consume_credits(self, user_id: int, amount: int = 1) -> bool:
-        """Consume credits from user account (FIFO - oldest first)"""
+    def add_credits_bulk(self, entries: list, commit: bool = True) -> int:
+        """Add several credit rows (dicts of Credit columns) with one INSERT and one UPDATE; commit=False leaves committing to the caller"""
+        if not entries:
+            return 0
+        
+        # Merge each user's amounts for the total_credits_earned update
+        amounts = {}
+        for entry in entries:
+            amounts[entry['user_id']] = amounts.get(entry['user_id'], 0) + entry['amount']
+        
         try:
-            # Get active credits ordered by creation date (FIFO)
-            credits = Credit.query.filter_by(
-                user_id=user_id, 
-                is_active=True
-            ).filter(Credit.balance > 0).order_by(Credit.created_at).all()
+            db.session.execute(insert(Credit), [{'balance': entry['amount'], **entry} for entry in entries])
             
-            total_available = sum(credit.balance for credit in credits)
+            # One UPDATE for all users, CASE picks each user's increment
+            increment = case(amounts, value=User.id, else_=0)
+            db.session.execute(
+                update(User)
+                .where(User.id.in_(list(amounts)))
+                .values(total_credits_earned=User.total_credits_earned + increment)
+                .execution_options(synchronize_session=False)
+            )
             
-            if total_available < amount:
-                logger.warning(f"Insufficient credits for user {user_id}. Available: {total_available}, Required: {amount}")
-                return False
+            if not commit:
+                invalidate_balances_on_commit(amounts)
+                return len(entries)
             
-            remaining_to_consume = amount
+            db.session.commit()
+            invalidate_balances(amounts)
+            return len(entries)
             
-            for credit in credits:
-                if remaining_to_consume <= 0:
-                    break
-                
-                if credit.balance >= remaining_to_consume:
-                    # This credit has enough balance
-                    credit.balance -= remaining_to_consume
-                    remaining_to_consume = 0
-                else:
-                    # Consume all of this credit and move to next
-                    remaining_to_consume -= credit.balance
-                    credit.balance = 0
-                
-                # Deactivate credit if balance is zero
-                if credit.balance == 0:
-                    credit.is_active = False
+        except Exception as e:
+            if commit:
+                db.session.rollback()
+            logger.error(f"Error adding credits in bulk: {e}")
+            raise
+    
+    def consume_credits(self, user_id: int, amount: int = 1, commit: bool = True) -> bool:
+        """Consume credits from user account (FIFO - oldest first); commit=False leaves committing to the caller"""
+        try:
+            if not self._debit_credits(user_id, amount):
+                if commit:
+                    db.session.rollback()
+                return False
             
             # Update user's total credits spent
-            user = User.query.get(user_id)
-            if user:
-                user.total_credits_spent += amount
+            db.session.execute(
+                update(User)
+                .where(User.id == user_id)
+                .values(total_credits_spent=User.total_credits_spent + amount)
+                .execution_options(synchronize_session=False)
+            )
+            
+            if not commit:
+                invalidate_balances_on_commit([user_id])
+                return True
             
             db.session.commit()
+            invalidate_balances([user_id])
             logger.info(f"Consumed {amount} credits from user {user_id}")
             
             return True
             
         except Exception as e:
-            db.session.rollback()
             logger.error(f"Error consuming credits for user {user_id}: {e}")
+            if not commit:
+                raise
+            db.session.rollback()
             return False
     
-    def refund_credits(self, user_id: int, amount: int, reason: str = None) -> Credit:
-        """Refund credits to a user account"""
+    def _debit_credits(self, user_id: int, amount: int) -> bool:
+        """Debit active credits FIFO in the current transaction, without committing"""
+        # Cheap precheck: users who can't afford the debit are turned away
+        # without locking or fetching their credit rows. A cached shortfall is
+        # only a hint (a grant may not have reached this cache yet, or may be
+        # uncommitted in this transaction), so confirm it against the SQL SUM.
+        if self.get_active_credit_balance(user_id) < amount:
+            balance = db.session.execute(_active_balance_stmt(user_id)).scalar() or 0
+            if balance < amount:
+                logger.warning(f"Insufficient credits for user {user_id}. Available: {balance}, Required: {amount}")
+                return False
+            cache.delete(_balance_key(user_id))
+        
+        # Serialize debits per user on PostgreSQL; released at commit/rollback
+        if db.session.get_bind().dialect.name == 'postgresql':
+            db.session.execute(select(func.pg_advisory_xact_lock(user_id)))
+        
+        # Lock active credits ordered by creation date (FIFO); only ids and
+        # balances are needed, so no ORM objects are built
+        credits = db.session.execute(_fifo_credits_stmt(user_id)).all()
+        
+        # Authoritative check under the row locks (the cached sum may be stale)
+        total_available = sum(credit.balance for credit in credits)
+        
+        if total_available < amount:
+            logger.warning(f"Insufficient credits for user {user_id}. Available: {total_available}, Required: {amount}")
+            return False
+        
+        # Split into the fully drained prefix and the partially debited boundary row
+        drained_ids = []
+        boundary_id = None
+        remaining_to_consume = amount
+        
+        for credit in credits:
+            if remaining_to_consume <= 0:
+                break
+            
+            if credit.balance > remaining_to_consume:
+                boundary_id = credit.id
+                break
+            
+            drained_ids.append(credit.id)
+            remaining_to_consume -= credit.balance
+        
+        if drained_ids:
+            db.session.execute(
+                update(Credit)
+                .where(Credit.id.in_(drained_ids))
+                .values(balance=0, is_active=False)
+                .execution_options(synchronize_session=False)
+            )
+        
+        if boundary_id is not None:
+            db.session.execute(
+                update(Credit)
+                .where(Credit.id == boundary_id)
+                .values(balance=Credit.balance - remaining_to_consume)
+                .execution_options(synchronize_session=False)
+            )
+        
+        return True
+    
+    def refund_credits(self, user_id: int, amount: int, reason: str = None, commit: bool = True) -> Credit:
+        """Refund credits to a user account; commit=False leaves committing to the caller"""
         return self.add_credits(
             user_id=user_id,
             amount=amount,
             credit_type=CreditType.BONUS,
             source=CreditSource.REFUND,
-            source_reference=reason
+            source_reference=reason,
+            commit=commit
         )
     
     def grant_admin_credits(self, user_id: int, amount: int, admin_id: int, reason: str = None) -> Credit:
@@ -118,59 +286,145 @@ class CreditService:
             amount=amount,
             credit_type=CreditType.BONUS,
             source=CreditSource.ADMIN_GRANT,
-            source_reference=f"admin_{admin_id}_{reason}" if reason else f"admin_{admin_id}"
+            source_reference=f"admin_{admin_id}_{reason}" if reason else f"admin_{admin_id}",
+            source_actor_id=admin_id,
+            source_reason=reason
+        )
+    
+    def grant_admin_credits_bulk(self, user_ids: list, amount: int, admin_id: int, reason: str = None) -> int:
+        """Grant the same credits to many users"""
+        return self.grant_admin_credits_many(
+            [(user_id, amount) for user_id in dict.fromkeys(user_ids)], admin_id, reason
         )
     
+    def grant_admin_credits_many(self, grants: list, admin_id: int, reason: str = None) -> int:
+        """Grant per-user credit amounts with batched multi-row INSERTs"""
+        # Merge repeated users so each gets one credit row and one total update
+        amounts = {}
+        for user_id, amount in grants:
+            amounts[user_id] = amounts.get(user_id, 0) + amount
+        if not amounts:
+            return 0
+        
+        source_reference = f"admin_{admin_id}_{reason}" if reason else f"admin_{admin_id}"
+        user_ids = list(amounts)
+        
+        try:
+            for start in range(0, len(user_ids), BULK_GRANT_BATCH_SIZE):
+                batch = user_ids[start:start + BULK_GRANT_BATCH_SIZE]
+                
+                self.add_credits_bulk([
+                    {
+                        'user_id': user_id,
+                        'credit_type': CreditType.BONUS,
+                        'amount': amounts[user_id],
+                        'source': CreditSource.ADMIN_GRANT,
+                        'source_reference': source_reference,
+                        'source_actor_id': admin_id,
+                        'source_reason': reason
+                    }
+                    for user_id in batch
+                ], commit=False)
+            
+            db.session.commit()
+            invalidate_balances(user_ids)
+            logger.info(f"Granted {sum(amounts.values())} credits to {len(user_ids)} users by admin {admin_id}")
+            
+            return len(user_ids)
+            
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error bulk granting credits: {e}")
+            raise
+    
     def expire_old_credits(self) -> int:
         """Expire old credits that have passed their expiration date"""
+        now = datetime.now(timezone.utc)
+        
         try:
-            expired_count = Credit.query.filter(
-                Credit.expires_at < datetime.now(timezone.utc),
-                Credit.is_active == True
-            ).update({'is_active': False})
+            # One UPDATE ... RETURNING gives the affected rows without a second SELECT
+            expired = db.session.execute(
+                update(Credit)
+                .where(Credit.expires_at < now, Credit.is_active == True)
+                .values(is_active=False)
+                .returning(Credit.id, Credit.user_id)
+                .execution_options(synchronize_session=False)
+            ).all()
             
             db.session.commit()
-            logger.info(f"Expired {expired_count} old credits")
             
-            return expired_count
+            user_ids = {row.user_id for row in expired}
+            invalidate_balances(user_ids)
+            logger.info(f"Expired {len(expired)} old credits across {len(user_ids)} users")
+            
+            return len(expired)
             
         except Exception as e:
             db.session.rollback()
             logger.error(f"Error expiring old credits: {e}")
             return 0
     
-    def get_credit_history(self, user_id: int, limit: int = 50, offset: int = 0) -> list:
-        """Get credit history for a user"""
-        return Credit.query.filter_by(user_id=user_id).order_by(
-            Credit.created_at.desc()
-        ).offset(offset).limit(limit).all()
+    def get_credit_history(self, user_id: int, limit: int = 50, after: tuple = None) -> list:
+        """Get credit history rows for a user, newest first"""
+        # Plain rows with the listed columns; history is read-only, so no ORM objects
+        query = select(*CREDIT_HISTORY_COLUMNS).where(Credit.user_id == user_id)
+        
+        # Keyset pagination: after is the (created_at, id) of the previous
+        # page's last credit, so deep pages don't scan skipped rows
+        if after is not None:
+            query = query.where(tuple_(Credit.created_at, Credit.id) < tuple_(*after))
+        
+        return db.session.execute(
+            query.order_by(Credit.created_at.desc(), Credit.id.desc()).limit(limit)
+        ).all()
     
     def get_credit_statistics(self) -> dict:
-        """Get system-wide credit statistics"""
+        """Get system-wide credit statistics, cached for CREDIT_STATS_CACHE_TTL seconds"""
+        cached = cache.get(CREDIT_STATS_CACHE_KEY)
+        if cached is not None:
+            return orjson.loads(cached)
+        
+        stats = self._build_credit_statistics()
+        if stats:
+            cache.set(CREDIT_STATS_CACHE_KEY, orjson.dumps(stats), ttl=CREDIT_STATS_CACHE_TTL)
+        return stats
+    
+    def _build_credit_statistics(self) -> dict:
+        """Aggregate system-wide credit statistics from the credits table"""
         try:
-            total_credits_issued = db.session.query(func.sum(Credit.amount)).scalar() or 0
-            total_credits_active = db.session.query(func.sum(Credit.balance)).filter_by(is_active=True).scalar() or 0
-            total_credits_consumed = total_credits_issued - total_credits_active
-            
-            # Credits by type
-            credits_by_type = db.session.query(
+            # One pass over credits grouped by (type, source); the totals and
+            # both breakdowns are rolled up from these few rows in Python
+            rows = db.session.query(
                 Credit.credit_type,
+                Credit.source,
                 func.sum(Credit.amount).label('total'),
-                func.sum(Credit.balance).label('remaining')
-            ).filter_by(is_active=True).group_by(Credit.credit_type).all()
+                func.count().filter(Credit.is_active == True).label('active_rows'),
+                func.sum(case((Credit.is_active == True, Credit.amount), else_=0)).label('active_total'),
+                func.sum(case((Credit.is_active == True, Credit.balance), else_=0)).label('remaining')
+            ).group_by(Credit.credit_type, Credit.source).all()
             
-            # Credits by source
-            credits_by_source = db.session.query(
-                Credit.source,
-                func.sum(Credit.amount).label('total')
-            ).group_by(Credit.source).all()
+            total_credits_issued = 0
+            total_credits_active = 0
+            by_type = {}
+            by_source = {}
+            
+            for row in rows:
+                total_credits_issued += row.total or 0
+                total_credits_active += row.remaining or 0
+                by_source[row.source.value] = by_source.get(row.source.value, 0) + (row.total or 0)
+                
+                # Type breakdown only covers active credits
+                if row.active_rows:
+                    entry = by_type.setdefault(row.credit_type.value, {'total': 0, 'remaining': 0})
+                    entry['total'] += row.active_total or 0
+                    entry['remaining'] += row.remaining or 0
             
             return {
                 'total_issued': total_credits_issued,
                 'total_active': total_credits_active,
-                'total_consumed': total_credits_consumed,
-                'by_type': {item.credit_type.value: {'total': item.total, 'remaining': item.remaining} for item in credits_by_type},
-                'by_source': {item.source.value: item.total for item in credits_by_source}
+                'total_consumed': total_credits_issued - total_credits_active,
+                'by_type': by_type,
+                'by_source': by_source
             }
             
         except Exception as e:
@@ -179,14 +433,23 @@ class CreditService:
     
     def validate_credit_transaction(self, user_id: int, amount: int) -> dict:
         """Validate if a credit transaction can be performed"""
-        user = User.query.get(user_id)
-        if not user:
+        # User status and active balance in one round trip
+        row = db.session.execute(
+            select(User.status, func.coalesce(func.sum(Credit.balance), 0).label('balance'))
+            .select_from(User)
+            .outerjoin(Credit, and_(Credit.user_id == User.id, Credit.is_active == True))
+            .where(User.id == user_id)
+            .group_by(User.id, User.status)
+        ).first()
+        if not row:
             return {'valid': False, 'reason': 'User not found'}
         
-        if user.status.value != 'active':
+        if row.status != UserStatus.ACTIVE:
             return {'valid': False, 'reason': 'User account is not active'}
         
-        current_balance = self.get_active_credit_balance(user_id)
+        # Seed the balance cache so the debit precheck that usually follows is free
+        current_balance = row.balance
+        cache.set(_balance_key(user_id), str(current_balance).encode(), ttl=BALANCE_CACHE_TTL)
         if current_balance < amount:
             return {
                 'valid': False, 
@@ -196,15 +459,43 @@ class CreditService:
         return {'valid': True, 'current_balance': current_balance}
     
     def get_expiring_credits(self, days_ahead: int = 7) -> list:
-        """Get credits that will expire within specified days"""
-        expiry_date = datetime.now(timezone.utc) + timedelta(days=days_ahead)
+        """Get per-user totals of credits that will expire within specified days"""
+        now = datetime.now(timezone.utc)
+        expiry_date = now + timedelta(days=days_ahead)
+        
+        # One row per user, so notifications go out once per user, not per credit
+        rows = db.session.query(
+            Credit.user_id,
+            func.sum(Credit.balance).label('total_expiring'),
+            func.min(Credit.expires_at).label('soonest_expires_at')
+        ).filter(
+            Credit.expires_at <= expiry_date,
+            Credit.expires_at > now,
+            Credit.is_active == True,
+            Credit.balance > 0
+        ).group_by(Credit.user_id).all()
+        
+        return [
+            {
+                'user_id': row.user_id,
+                'total_expiring': row.total_expiring,
+                'soonest_expires_at': row.soonest_expires_at
+            }
+            for row in rows
+        ]
+    
+    def get_expiring_credits_detailed(self, user_id: int, days_ahead: int = 7) -> list:
+        """Get a user's credits that will expire within specified days"""
+        now = datetime.now(timezone.utc)
+        expiry_date = now + timedelta(days=days_ahead)
         
         return Credit.query.filter(
+            Credit.user_id == user_id,
             Credit.expires_at <= expiry_date,
-            Credit.expires_at > datetime.now(timezone.utc),
+            Credit.expires_at > now,
             Credit.is_active == True,
             Credit.balance > 0
-        ).all()
+        ).order_by(Credit.expires_at).all()
     
     def transfer_credits(self, from_user_id: int, to_user_id: int, amount: int, reason: str = None) -> bool:
         """Transfer credits between users (admin function)"""
@@ -214,23 +505,46 @@ class CreditService:
             if not validation['valid']:
                 return False
             
-            # Consume from source user
-            if not self.consume_credits(from_user_id, amount):
+            # Debit, credit and both users' totals commit together
+            if not self._debit_credits(from_user_id, amount):
+                db.session.rollback()
                 return False
             
-            # Add to destination user
-            self.add_credits(
+            db.session.add(Credit(
                 user_id=to_user_id,
-                amount=amount,
                 credit_type=CreditType.BONUS,
+                amount=amount,
+                balance=amount,
                 source=CreditSource.ADMIN_GRANT,
-                source_reference=f"transfer_from_{from_user_id}_{reason}" if reason else f"transfer_from_{from_user_id}"
+                source_reference=f"transfer_from_{from_user_id}_{reason}" if reason else f"transfer_from_{from_user_id}",
+                source_actor_id=from_user_id,
+                source_reason=reason
+            ))
+            
+            db.session.execute(
+                update(User)
+                .where(User.id.in_([from_user_id, to_user_id]))
+                .values(
+                    total_credits_spent=case(
+                        (User.id == from_user_id, User.total_credits_spent + amount),
+                        else_=User.total_credits_spent
+                    ),
+                    total_credits_earned=case(
+                        (User.id == to_user_id, User.total_credits_earned + amount),
+                        else_=User.total_credits_earned
+                    )
+                )
+                .execution_options(synchronize_session=False)
             )
             
+            db.session.commit()
+            invalidate_balances([from_user_id, to_user_id])
+            
             logger.info(f"Transferred {amount} credits from user {from_user_id} to user {to_user_id}")
             return True
             
         except Exception as e:
+            db.session.rollback()
             logger.error(f"Error transferring credits: {e}")
             return False
 
@@ -1,36 +1,218 @@
 import os
-import sys
-import tempfile
-import subprocess
+import asyncio
+import atexit
+import errno
 import logging
-from pathlib import Path
-from typing import Optional, Dict, Any
+import time
+from typing import Optional, Dict, Any, NamedTuple
 import shutil
+from configparser import ConfigParser
+from concurrent.futures import ThreadPoolExecutor
 from src.models.database import db, FaceSwapJob, JobStatus, JobType
-from src.services.credit_service import CreditService
-import uuid
-import json
+from sqlalchemy import func, select, update
+from src.services.credit_service import CreditService, no_expire_on_commit
+from src.services.cache import MemoryCache
+from src.services.facefusion_pool import FaceFusionWorkerPool, FACEFUSION_WORKERS
 
 logger = logging.getLogger(__name__)
 
+# Filesystem locations, resolved once to absolute paths without '..'
+BASE_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+FACEFUSION_PATH = os.path.join(BASE_DIR, 'external', 'facefusion')
+TEMP_DIR = os.path.join(BASE_DIR, 'temp')
+OUTPUT_DIR = os.path.join(BASE_DIR, 'outputs')
+
+MAX_CONCURRENT_FACESWAPS = int(os.getenv('MAX_CONCURRENT_FACESWAPS', FACEFUSION_WORKERS))
+
+# Queued image jobs a queue worker runs together in one FaceFusion round trip
+IMAGE_BATCH_SIZE = int(os.getenv('FACESWAP_IMAGE_BATCH_SIZE', 8))
+
+# Per-job FaceFusion timeouts in seconds
+IMAGE_JOB_TIMEOUT = 300
+VIDEO_JOB_TIMEOUT = 600
+
+# RAM-backed scratch space for the frames FaceFusion extracts from videos
+FACESWAP_TMPFS = os.getenv('FACESWAP_TMPFS', '/dev/shm/faceswap')
+
+# Free tmpfs space needed per byte of target file; decoded PNG frames take
+# far more room than the compressed video they came from
+IMAGE_TMPFS_FACTOR = 2
+VIDEO_TMPFS_FACTOR = 50
+
+class JobKind(NamedTuple):
+    """How FaceFusion runs and reports one job type"""
+    output_filename: str
+    timeout: int
+    tmpfs_factor: int
+    processing_method: str
+    label: str
+    missing_target_error: str
+
+JOB_KINDS = {
+    JobType.IMAGE: JobKind(
+        'faceswap_{}.png', IMAGE_JOB_TIMEOUT, IMAGE_TMPFS_FACTOR, 'facefusion_worker', 'Face swap',
+        'Image face swap requires both source and target images. Please send two images.'
+    ),
+    JobType.VIDEO: JobKind(
+        'faceswap_video_{}.mp4', VIDEO_JOB_TIMEOUT, VIDEO_TMPFS_FACTOR, 'facefusion_worker_video', 'Video face swap',
+        'Video face swap requires a face image and a target video.'
+    )
+}
+
+# Where finished outputs are published (a mounted storage bucket or a volume
+# shared with the bot); unset leaves them in outputs/
+FACESWAP_PUBLISH_DIR = os.getenv('FACESWAP_PUBLISH_DIR')
+
+# Seconds get_system_status reuses its job counts, so frequent polling
+# does not hit the database each time
+SYSTEM_STATUS_TTL = 1.0
+
+# get_job_status keeps finished jobs until evicted (they never change) and
+# queued/processing jobs for a moment, so status polls rarely hit the database
+JOB_STATUS_CACHE_SIZE = 4096
+ACTIVE_JOB_STATUS_TTL = 0.5
+TERMINAL_JOB_STATUSES = frozenset({JobStatus.COMPLETED, JobStatus.FAILED, JobStatus.CANCELLED})
+
+_job_status_cache = MemoryCache(max_entries=JOB_STATUS_CACHE_SIZE)
+
+# Threads deleting old output files in cleanup_old_files
+CLEANUP_WORKERS = 8
+
+# Tail of FaceFusion's log kept in a failed job's error (and sent to the user)
+FACEFUSION_ERROR_CHARS = 1000
+
+# FaceFusion execution providers in order of preference, with the ONNX
+# Runtime provider each needs; FaceFusion falls back along the list
+PREFERRED_EXECUTION_PROVIDERS = (
+    ('tensorrt', 'TensorrtExecutionProvider'),
+    ('cuda', 'CUDAExecutionProvider'),
+    ('cpu', 'CPUExecutionProvider')
+)
+
+# FaceFusion's swapper when facefusion.ini doesn't set one, and the shipped
+# half-precision variants of configured swappers (same model, FP16 weights),
+# used on GPU providers
+FACEFUSION_DEFAULT_FACE_SWAPPER_MODEL = 'hyperswap_1a_256'
+FP16_FACE_SWAPPER_MODELS = {'inswapper_128': 'inswapper_128_fp16'}
+
+def _job_status_key(job_id: int) -> str:
+    return f"job:{job_id}"
+
+def _forget_job_status(job_ids):
+    """Drop cached statuses after a job write"""
+    for job_id in job_ids:
+        _job_status_cache.delete(_job_status_key(job_id))
+
+def _remove_file(path: str) -> bool:
+    """Delete a file, returning whether it was removed"""
+    try:
+        os.unlink(path)
+        return True
+    except OSError as e:
+        logger.warning(f"Could not remove {path}: {e}")
+        return False
+
+def _copy_file_in_kernel(src_fd: int, dst_fd: int, size: int):
+    """Copy size bytes between files without passing them through Python"""
+    copied = 0
+    try:
+        # Server-side copy or reflink where the filesystems support it
+        while copied < size:
+            n = os.copy_file_range(src_fd, dst_fd, size - copied)
+            if n == 0:
+                break
+            copied += n
+    except (AttributeError, OSError):
+        # Older kernels reject cross-filesystem copy_file_range
+        while copied < size:
+            n = os.sendfile(dst_fd, src_fd, copied, size - copied)
+            if n == 0:
+                break
+            copied += n
+
+def configured_face_swapper_model(facefusion_path: str) -> str:
+    """The swapper FaceFusion runs by default, per its facefusion.ini"""
+    config = ConfigParser()
+    config.read(os.path.join(facefusion_path, 'facefusion.ini'), encoding='utf-8')
+    return config.get('processors', 'face_swapper_model', fallback='').strip() or FACEFUSION_DEFAULT_FACE_SWAPPER_MODEL
+
+def detect_execution_providers() -> list:
+    """FaceFusion execution providers this host's ONNX Runtime supports, fastest first"""
+    configured = os.getenv('FACEFUSION_EXECUTION_PROVIDERS')
+    if configured:
+        return [p.strip() for p in configured.split(',') if p.strip()]
+    
+    try:
+        from onnxruntime import get_available_providers
+    except ImportError:
+        return ['cpu']
+    
+    available = set(get_available_providers())
+    return [name for name, provider in PREFERRED_EXECUTION_PROVIDERS if provider in available] or ['cpu']
+
 class FaceSwapService:
     """Service for handling face swap operations using FaceFusion"""
     
     def __init__(self):
         self.credit_service = CreditService()
-        self.facefusion_path = os.path.join(os.path.dirname(__file__), '../../external/facefusion')
-        self.temp_dir = os.path.join(os.path.dirname(__file__), '../../temp')
-        self.output_dir = os.path.join(os.path.dirname(__file__), '../../outputs')
+        self.facefusion_path = FACEFUSION_PATH
+        self.temp_dir = TEMP_DIR
+        self.output_dir = OUTPUT_DIR
         
         # Ensure directories exist
         os.makedirs(self.temp_dir, exist_ok=True)
         os.makedirs(self.output_dir, exist_ok=True)
         
+        self.publish_dir = FACESWAP_PUBLISH_DIR
+        if self.publish_dir:
+            os.makedirs(self.publish_dir, exist_ok=True)
+        
+        # Use tmpfs for FaceFusion's intermediate files when the host has one
+        self.tmpfs_dir = None
+        if os.path.isdir(os.path.dirname(FACESWAP_TMPFS)):
+            try:
+                os.makedirs(FACESWAP_TMPFS, exist_ok=True)
+                self.tmpfs_dir = FACESWAP_TMPFS
+            except OSError as e:
+                logger.warning(f"Cannot use {FACESWAP_TMPFS} for FaceFusion temp files: {e}")
+        
         # Check if FaceFusion is available
         self.facefusion_available = os.path.exists(os.path.join(self.facefusion_path, 'facefusion.py'))
         
         if not self.facefusion_available:
             logger.warning("FaceFusion not found at expected path. Face swap functionality will be limited.")
+        
+        # (counts, expires_at) cached by get_system_status
+        self._job_counts = (None, 0.0)
+        
+        # GPU providers when present (TensorRT engines are cached by FaceFusion
+        # under .caches, so they are only built once); CPU otherwise
+        self.execution_providers = detect_execution_providers()
+        logger.info(f"FaceFusion execution providers: {', '.join(self.execution_providers)}")
+        
+        # Keep FaceFusion's configured swapper; on GPUs switch to its FP16
+        # weights when FaceFusion ships them, which halves memory traffic
+        self.face_swapper_model = os.getenv('FACEFUSION_FACE_SWAPPER_MODEL') or (
+            FP16_FACE_SWAPPER_MODELS.get(configured_face_swapper_model(self.facefusion_path))
+            if self.execution_providers[0] != 'cpu' else None
+        )
+        model_args = ('--face-swapper-model', self.face_swapper_model) if self.face_swapper_model else ()
+        
+        # Options shared by every FaceFusion run; jobs only add their paths
+        self._facefusion_args = (
+            '--processors', 'face_swapper',
+            *model_args,
+            '--execution-providers', *self.execution_providers,
+            '--video-memory-strategy', 'tolerant'  # Keep models loaded between jobs
+        )
+        
+        # Long-running FaceFusion processes (started on first use) keep models
+        # loaded, so jobs skip interpreter startup and model loading
+        self.worker_pool = FaceFusionWorkerPool(self.facefusion_path)
+        atexit.register(self.worker_pool.shutdown)
+        
+        # Bounds jobs waiting on FaceFusion from the bot's event loop
+        self._job_slots = asyncio.Semaphore(MAX_CONCURRENT_FACESWAPS)
     
     def create_face_swap_job(self, user_id: int, job_type: JobType, 
                            source_file_path: str, target_file_path: str = None,
@@ -57,473 +239,373 @@ class FaceSwapService:
             logger.error(f"Error creating face swap job: {e}")
             raise
     
-    def process_face_swap_job(self, job_id: int) -> Dict[str, Any]:
-        """Process a face swap job"""
+    def process_face_swap_job(self, job_id: int, claimed: bool = False) -> Dict[str, Any]:
+        """Process a face swap job; claimed=True for jobs already taken with claim_next"""
         job = FaceSwapJob.query.get(job_id)
         if not job:
             return {'success': False, 'error': 'Job not found'}
         
+        # Credits are only taken once _start_job succeeds, so only errors
+        # after that point are refunded
+        error = self._start_job(job, claimed=claimed)
+        if error:
+            return error
+        
         try:
-            # Update job status
-            job.status = JobStatus.PROCESSING
-            job.started_at = db.func.now()
-            db.session.commit()
-            
-            # Check if user has enough credits
-            validation = self.credit_service.validate_credit_transaction(job.user_id, job.credits_consumed)
-            if not validation['valid']:
-                job.status = JobStatus.FAILED
-                job.error_message = validation['reason']
-                db.session.commit()
-                return {'success': False, 'error': validation['reason']}
-            
-            # Consume credits
-            if not self.credit_service.consume_credits(job.user_id, job.credits_consumed):
-                job.status = JobStatus.FAILED
-                job.error_message = 'Failed to consume credits'
-                db.session.commit()
-                return {'success': False, 'error': 'Failed to consume credits'}
-            
-            # Process the face swap
-            if job.job_type == JobType.IMAGE:
-                result = self._process_image_face_swap(job)
-            elif job.job_type == JobType.VIDEO:
-                result = self._process_video_face_swap(job)
-            else:
-                result = {'success': False, 'error': 'Unsupported job type'}
-            
-            # Update job with result
-            if result['success']:
-                job.status = JobStatus.COMPLETED
-                job.result_file_path = result.get('output_path')
-                job.processing_metadata = result.get('metadata', {})
-            else:
-                job.status = JobStatus.FAILED
-                job.error_message = result.get('error', 'Unknown error')
-                
-                # Refund credits on failure
-                self.credit_service.refund_credits(
-                    user_id=job.user_id,
-                    amount=job.credits_consumed,
-                    reason=f"Job {job.id} failed: {job.error_message}"
-                )
-            
-            job.completed_at = db.func.now()
-            db.session.commit()
-            
-            logger.info(f"Completed face swap job {job.id} with status {job.status.value}")
-            return result
+            result = self._run_facefusion(job)
+            return self._finish_job(job, result)
             
         except Exception as e:
-            job.status = JobStatus.FAILED
-            job.error_message = str(e)
-            job.completed_at = db.func.now()
-            db.session.commit()
-            
-            # Refund credits on error
-            self.credit_service.refund_credits(
-                user_id=job.user_id,
-                amount=job.credits_consumed,
-                reason=f"Job {job.id} error: {str(e)}"
-            )
-            
-            logger.error(f"Error processing face swap job {job.id}: {e}")
-            return {'success': False, 'error': str(e)}
+            return self._fail_job(job, e)
     
-    def _process_image_face_swap(self, job: FaceSwapJob) -> Dict[str, Any]:
-        """Process image face swap using FaceFusion"""
-        if not self.facefusion_available:
-            return {'success': False, 'error': 'FaceFusion not available'}
+    async def process_face_swap_job_async(self, job_id: int) -> Dict[str, Any]:
+        """Process a face swap job without blocking the bot's event loop"""
+        job = FaceSwapJob.query.get(job_id)
+        if not job:
+            return {'success': False, 'error': 'Job not found'}
+        
+        error = self._start_job(job)
+        if error:
+            return error
         
         try:
-            # Generate unique output filename
-            output_filename = f"faceswap_{job.id}_{uuid.uuid4().hex[:8]}.png"
-            output_path = os.path.join(self.output_dir, output_filename)
-            
-            # For image face swap, we need both source and target
-            if not job.target_file_path:
-                return {
-                    'success': False, 
-                    'error': 'Image face swap requires both source and target images. Please send two images.'
-                }
-            
-            # Prepare FaceFusion command for headless operation
-            cmd = [
-                sys.executable,
-                os.path.join(self.facefusion_path, 'facefusion.py'),
-                'headless-run',
-                '--source-paths', job.source_file_path,
-                '--target-path', job.target_file_path,
-                '--output-path', output_path,
-                '--processors', 'face_swapper',
-                '--execution-providers', 'cpu'  # Use CPU for compatibility
-            ]
-            
-            # Run FaceFusion
-            logger.info(f"Running FaceFusion command for job {job.id}")
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=300,  # 5 minute timeout
-                cwd=self.facefusion_path
-            )
+            # Load the job's columns on this thread; the FaceFusion wait runs
+            # in a worker thread that has no app context or session. Then end
+            # the read transaction (keeping the loaded values) so no pooled
+            # connection sits idle in transaction for the whole run.
+            db.session.refresh(job)
+            with no_expire_on_commit(db.session()):
+                db.session.commit()
+            async with self._job_slots:
+                result = await asyncio.to_thread(self._run_facefusion, job)
+            return self._finish_job(job, result)
             
-            if result.returncode == 0 and os.path.exists(output_path):
-                # Get file size
-                file_size = os.path.getsize(output_path)
-                
-                return {
-                    'success': True,
-                    'output_path': output_path,
-                    'metadata': {
-                        'file_size_bytes': file_size,
-                        'facefusion_stdout': result.stdout,
-                        'processing_method': 'facefusion_cpu'
-                    }
-                }
-            else:
-                error_msg = result.stderr or result.stdout or 'Unknown FaceFusion error'
-                logger.error(f"FaceFusion failed for job {job.id}: {error_msg}")
-                return {'success': False, 'error': f'Face swap failed: {error_msg}'}
-                
-        except subprocess.TimeoutExpired:
-            return {'success': False, 'error': 'Face swap processing timed out'}
         except Exception as e:
-            logger.error(f"Error in image face swap: {e}")
-            return {'success': False, 'error': str(e)}
+            return self._fail_job(job, e)
     
-    def _process_video_face_swap(self, job: FaceSwapJob) -> Dict[str, Any]:
-        """Process video face swap using FaceFusion"""
-        if not self.facefusion_available:
-            return {'success': False, 'error': 'FaceFusion not available'}
+    def process_image_job_batch(self, job_id: int, max_n: int = IMAGE_BATCH_SIZE) -> list:
+        """Process a queued image job along with other queued image jobs on one warm worker; returns (job, result) pairs"""
+        results = []
+        batch = []
+        for job in self._drain_batch(job_id, max_n):
+            error = self._start_job(job, claimed=True)
+            if error:
+                results.append((job, error))
+                continue
+            
+            try:
+                prepared = self._prepare_job(job, JOB_KINDS[JobType.IMAGE])
+                if 'error' in prepared:
+                    results.append((job, self._finish_job(job, prepared)))
+                else:
+                    batch.append((job, prepared))
+            except Exception as e:
+                results.append((job, self._fail_job(job, e)))
         
+        if not batch:
+            return results
+        
+        # One worker round trip for the whole batch
+        logger.info(f"Running FaceFusion for image jobs {[job.id for job, _ in batch]}")
         try:
-            # Generate unique output filename
-            output_filename = f"faceswap_video_{job.id}_{uuid.uuid4().hex[:8]}.mp4"
-            output_path = os.path.join(self.output_dir, output_filename)
-            
-            # For video face swap, source is the face image, target is the video
-            if not job.target_file_path:
-                return {
-                    'success': False, 
-                    'error': 'Video face swap requires a face image and a target video.'
-                }
-            
-            # Prepare FaceFusion command for video
-            cmd = [
-                sys.executable,
-                os.path.join(self.facefusion_path, 'facefusion.py'),
-                'headless-run',
-                '--source-paths', job.source_file_path,
-                '--target-path', job.target_file_path,
-                '--output-path', output_path,
-                '--processors', 'face_swapper',
-                '--execution-providers', 'cpu'  # Use CPU for compatibility
-            ]
-            
-            # Run FaceFusion
-            logger.info(f"Running FaceFusion video command for job {job.id}")
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=600,  # 10 minute timeout for videos
-                cwd=self.facefusion_path
+            runs = self.worker_pool.run_batch(
+                [prepared['args'] for _, prepared in batch],
+                timeout=IMAGE_JOB_TIMEOUT * len(batch)
             )
-            
-            if result.returncode == 0 and os.path.exists(output_path):
-                # Get file size
-                file_size = os.path.getsize(output_path)
-                
-                return {
-                    'success': True,
-                    'output_path': output_path,
-                    'metadata': {
-                        'file_size_bytes': file_size,
-                        'facefusion_stdout': result.stdout,
-                        'processing_method': 'facefusion_cpu_video'
-                    }
-                }
-            else:
-                error_msg = result.stderr or result.stdout or 'Unknown FaceFusion error'
-                logger.error(f"FaceFusion video failed for job {job.id}: {error_msg}")
-                return {'success': False, 'error': f'Video face swap failed: {error_msg}'}
-                
-        except subprocess.TimeoutExpired:
-            return {'success': False, 'error': 'Video face swap processing timed out'}
-        except Exception as e:
-            logger.error(f"Error in video face swap: {e}")
-            return {'success': False, 'error': str(e)}
-    
-    def get_job_status(self, job_id: int) -> Optional[FaceSwapJob]:
-        """Get job status"""
-        return FaceSwapJob.query.get(job_id)
+        except TimeoutError:
+            runs = None
+        
+        for i, (job, prepared) in enumerate(batch):
+            try:
+                if runs is None:
+                    result = {'success': False, 'error': 'Face swap processing timed out'}
+                else:
+                    returncode, output = runs[i]
+                    result = self._job_result(job, JOB_KINDS[JobType.IMAGE], prepared['output_path'], returncode, output)
+                results.append((job, self._finish_job(job, result)))
+            except Exception as e:
+                results.append((job, self._fail_job(job, e)))
+        
+        return results
     
-    def get_user_jobs(self, user_id: int, limit: int = 10) -> list:
-        """Get user's face swap jobs"""
-        return FaceSwapJob.query.filter_by(user_id=user_id).order_by(
-            FaceSwapJob.created_at.desc()
-        ).limit(limit).all()
+    def claim_next(self, job_type: JobType = None) -> Optional[int]:
+        """Claim the oldest queued job, skipping rows other workers are claiming; returns its id for process_face_swap_job(job_id, claimed=True)"""
+        stmt = select(FaceSwapJob.id).where(FaceSwapJob.status == JobStatus.QUEUED)
+        if job_type is not None:
+            stmt = stmt.where(FaceSwapJob.job_type == job_type)
+        
+        job_id = db.session.scalars(
+            stmt.order_by(FaceSwapJob.created_at).limit(1).with_for_update(skip_locked=True)
+        ).first()
+        if job_id is None or not self._claim_job(job_id):
+            db.session.rollback()
+            return None
+        
+        db.session.commit()
+        _forget_job_status([job_id])
+        return job_id
     
-    def cleanup_old_files(self, days_old: int = 7) -> int:
-        """Clean up old output files"""
-        try:
-            import time
-            cutoff_time = time.time() - (days_old * 24 * 60 * 60)
-            cleaned_count = 0
-            
-            for filename in os.listdir(self.output_dir):
-                file_path = os.path.join(self.output_dir, filename)
-                if os.path.isfile(file_path) and os.path.getmtime(file_path) < cutoff_time:
-                    os.remove(file_path)
-                    cleaned_count += 1
-            
-            logger.info(f"Cleaned up {cleaned_count} old files")
-            return cleaned_count
-            
-        except Exception as e:
-            logger.error(f"Error cleaning up old files: {e}")
-            return 0
+    def _claim_job(self, job_id: int) -> bool:
+        """Move a queued job to PROCESSING in the current transaction; False if another worker has it"""
+        return db.session.execute(
+            update(FaceSwapJob)
+            .where(FaceSwapJob.id == job_id, FaceSwapJob.status == JobStatus.QUEUED)
+            .values(status=JobStatus.PROCESSING, started_at=db.func.now())
+            .returning(FaceSwapJob.id)
+            .execution_options(synchronize_session=False)
+        ).first() is not None
     
-    def get_system_status(self) -> Dict[str, Any]:
-        """Get face swap system status"""
-        return {
-            'facefusion_available': self.facefusion_available,
-            'facefusion_path': self.facefusion_path,
-            'temp_dir_exists': os.path.exists(self.temp_dir),
-            'output_dir_exists': os.path.exists(self.output_dir),
-            'pending_jobs': FaceSwapJob.query.filter_by(status=JobStatus.QUEUED).count(),
-            'processing_jobs': FaceSwapJob.query.filter_by(status=JobStatus.PROCESSING).count()
-        }
+    def _drain_batch(self, job_id: int, max_n: int) -> list:
+        """Claim a queued image job plus up to max_n - 1 other queued image jobs, oldest first"""
+        # Rows another worker is draining right now are skipped, not waited on
+        others = db.session.scalars(
+            select(FaceSwapJob.id)
+            .where(
+                FaceSwapJob.status == JobStatus.QUEUED,
+                FaceSwapJob.job_type == JobType.IMAGE,
+                FaceSwapJob.id != job_id
+            )
+            .order_by(FaceSwapJob.created_at)
+            .limit(max_n - 1)
+            .with_for_update(skip_locked=True)
+        ).all()
+        
+        # The status check makes the claim atomic, so two queue workers never
+        # run the same job; whatever another worker claimed first is skipped
+        claimed = db.session.scalars(
+            update(FaceSwapJob)
+            .where(FaceSwapJob.id.in_([job_id, *others]), FaceSwapJob.status == JobStatus.QUEUED)
+            .values(status=JobStatus.PROCESSING, started_at=db.func.now())
+            .returning(FaceSwapJob.id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        db.session.commit()
+        _forget_job_status(claimed)
+        
+        if not claimed:
+            return []
+        return FaceSwapJob.query.filter(FaceSwapJob.id.in_(claimed)).order_by(FaceSwapJob.created_at).all()
     
-    def create_face_swap_job(self, user_id: int, job_type: JobType, 
-                           source_file_path: str, target_file_path: str = None,
-                           telegram_message_id: int = None) -> FaceSwapJob:
-        """Create a new face swap job"""
+    def _start_job(self, job: FaceSwapJob, claimed: bool = False) -> Optional[Dict[str, Any]]:
+        """Claim a job and take its credits in one commit; returns None once the debit is committed, else an error result (nothing charged)"""
+        job_id = job.id
         try:
-            job = FaceSwapJob(
-                user_id=user_id,
-                job_type=job_type,
-                source_file_path=source_file_path,
-                target_file_path=target_file_path,
-                telegram_message_id=telegram_message_id,
-                status=JobStatus.QUEUED
-            )
-            
-            db.session.add(job)
-            db.session.commit()
-            
-            logger.info(f"Created face swap job {job.id} for user {user_id}")
-            return job
-            
+            return self._claim_and_charge(job, claimed)
         except Exception as e:
+            # Claim or commit failed, so nothing was charged; no refund
             db.session.rollback()
-            logger.error(f"Error creating face swap job: {e}")
-            raise
+            logger.error(f"Error starting face swap job {job_id}: {e}")
+            error = f"Failed to start job: {e}"
+            try:
+                # The rollback undid an unclaimed job's claim, so it is only
+                # failed if still QUEUED, never under another worker's claim
+                self._mark_failed(job_id, error, JobStatus.PROCESSING if claimed else JobStatus.QUEUED)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+            _forget_job_status([job_id])
+            return {'success': False, 'error': error}
     
-    def process_face_swap_job(self, job_id: int) -> Dict[str, Any]:
-        """Process a face swap job"""
-        job = FaceSwapJob.query.get(job_id)
-        if not job:
-            return {'success': False, 'error': 'Job not found'}
+    def _claim_and_charge(self, job: FaceSwapJob, claimed: bool) -> Optional[Dict[str, Any]]:
+        """_start_job's transaction: claim, debit (or mark FAILED) and commit"""
+        # Only one caller can move the job out of QUEUED, so a job is never
+        # run (and charged) twice
+        if not claimed and not self._claim_job(job.id):
+            db.session.rollback()
+            return {'success': False, 'error': 'Job is already being processed', 'claimed': False}
         
+        error = None
         try:
-            # Update job status
-            job.status = JobStatus.PROCESSING
-            job.started_at = db.func.now()
-            db.session.commit()
-            
-            # Check if user has enough credits
-            validation = self.credit_service.validate_credit_transaction(job.user_id, job.credits_consumed)
-            if not validation['valid']:
-                job.status = JobStatus.FAILED
-                job.error_message = validation['reason']
-                db.session.commit()
-                return {'success': False, 'error': validation['reason']}
-            
-            # Consume credits
-            if not self.credit_service.consume_credits(job.user_id, job.credits_consumed):
-                job.status = JobStatus.FAILED
-                job.error_message = 'Failed to consume credits'
-                db.session.commit()
-                return {'success': False, 'error': 'Failed to consume credits'}
-            
-            # Process the face swap
-            if job.job_type == JobType.IMAGE:
-                result = self._process_image_face_swap(job)
-            elif job.job_type == JobType.VIDEO:
-                result = self._process_video_face_swap(job)
-            else:
-                result = {'success': False, 'error': 'Unsupported job type'}
-            
-            # Update job with result
-            if result['success']:
-                job.status = JobStatus.COMPLETED
-                job.result_file_path = result.get('output_path')
-                job.processing_metadata = result.get('metadata', {})
-            else:
-                job.status = JobStatus.FAILED
-                job.error_message = result.get('error', 'Unknown error')
+            # A savepoint, so a failed debit is undone without the claim
+            with db.session.begin_nested():
+                # Check if user has enough credits
+                validation = self.credit_service.validate_credit_transaction(job.user_id, job.credits_consumed)
+                if not validation['valid']:
+                    error = validation['reason']
                 
-                # Refund credits on failure
-                self.credit_service.refund_credits(
-                    user_id=job.user_id,
-                    amount=job.credits_consumed,
-                    reason=f"Job {job.id} failed: {job.error_message}"
-                )
-            
-            job.completed_at = db.func.now()
-            db.session.commit()
-            
-            logger.info(f"Completed face swap job {job.id} with status {job.status.value}")
-            return result
-            
+                # Consume credits in the same transaction as the status change
+                elif not self.credit_service.consume_credits(job.user_id, job.credits_consumed, commit=False):
+                    error = 'Failed to consume credits'
         except Exception as e:
+            logger.error(f"Error taking credits for job {job.id}: {e}")
+            error = 'Failed to consume credits'
+        
+        if error:
+            self._mark_failed(job.id, error, JobStatus.PROCESSING)
+        db.session.commit()
+        _forget_job_status([job.id])
+        
+        return {'success': False, 'error': error} if error else None
+    
+    def _mark_failed(self, job_id: int, error: str, expected_status: JobStatus):
+        """Mark a job FAILED in the current transaction without refunding it, if it is still in expected_status"""
+        # A single UPDATE instead of loading and dirtying the job
+        db.session.execute(
+            update(FaceSwapJob)
+            .where(FaceSwapJob.id == job_id, FaceSwapJob.status == expected_status)
+            .values(status=JobStatus.FAILED, error_message=error, completed_at=db.func.now())
+            .execution_options(synchronize_session=False)
+        )
+    
+    def _finish_job(self, job: FaceSwapJob, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Store a job's result, refunding its credits on failure, in one commit"""
+        # Update job with result
+        if result['success']:
+            job.status = JobStatus.COMPLETED
+            job.result_file_path = result.get('output_path')
+            job.processing_metadata = result.get('metadata', {})
+        else:
             job.status = JobStatus.FAILED
-            job.error_message = str(e)
-            job.completed_at = db.func.now()
-            db.session.commit()
+            job.error_message = result.get('error', 'Unknown error')
             
-            # Refund credits on error
+            # Refund credits on failure
             self.credit_service.refund_credits(
                 user_id=job.user_id,
                 amount=job.credits_consumed,
-                reason=f"Job {job.id} error: {str(e)}"
+                reason=f"Job {job.id} failed: {job.error_message}",
+                commit=False
             )
-            
-            logger.error(f"Error processing face swap job {job.id}: {e}")
-            return {'success': False, 'error': str(e)}
+        
+        job.completed_at = db.func.now()
+        job_id, status = job.id, job.status
+        db.session.commit()
+        _forget_job_status([job_id])
+        
+        logger.info(f"Completed face swap job {job_id} with status {status.value}")
+        return result
+    
+    def _fail_job(self, job: FaceSwapJob, e: Exception) -> Dict[str, Any]:
+        """Mark a started (charged) job as failed after an unexpected error and refund its credits, in one commit"""
+        # The error may have left the session's transaction unusable
+        db.session.rollback()
+        
+        job.status = JobStatus.FAILED
+        job.error_message = str(e)
+        job.completed_at = db.func.now()
+        
+        # Refund credits on error
+        self.credit_service.refund_credits(
+            user_id=job.user_id,
+            amount=job.credits_consumed,
+            reason=f"Job {job.id} error: {str(e)}",
+            commit=False
+        )
+        job_id = job.id
+        db.session.commit()
+        _forget_job_status([job_id])
+        
+        logger.error(f"Error processing face swap job {job_id}: {e}")
+        return {'success': False, 'error': str(e)}
     
-    def _process_image_face_swap(self, job: FaceSwapJob) -> Dict[str, Any]:
-        """Process image face swap using roop"""
-        if not self.roop_available:
-            return {'success': False, 'error': 'Roop not available'}
+    def _run_facefusion(self, job: FaceSwapJob) -> Dict[str, Any]:
+        """Run the face swap for a started job on a warm FaceFusion worker"""
+        kind = JOB_KINDS.get(job.job_type)
+        if kind is None:
+            return {'success': False, 'error': 'Unsupported job type'}
         
         try:
-            # Generate unique output filename
-            output_filename = f"faceswap_{job.id}_{uuid.uuid4().hex[:8]}.png"
-            output_path = os.path.join(self.output_dir, output_filename)
-            
-            # For image face swap, we need both source and target
-            # If only source is provided, we'll create a placeholder message
-            if not job.target_file_path:
-                return {
-                    'success': False, 
-                    'error': 'Image face swap requires both source and target images. Please send two images.'
-                }
+            prepared = self._prepare_job(job, kind)
+            if 'error' in prepared:
+                return prepared
             
-            # Prepare roop command
-            cmd = [
-                sys.executable,
-                os.path.join(self.roop_path, 'run.py'),
-                '--source', job.source_file_path,
-                '--target', job.target_file_path,
-                '--output', output_path,
-                '--execution-provider', 'cpu',  # Use CPU for compatibility
-                '--frame-processor', 'face_swapper'
-            ]
+            logger.info(f"Running FaceFusion for {job.job_type.value} job {job.id}")
+            returncode, output = self.worker_pool.run(prepared['args'], timeout=kind.timeout)
+            return self._job_result(job, kind, prepared['output_path'], returncode, output)
             
-            # Run roop
-            logger.info(f"Running roop command for job {job.id}")
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=300,  # 5 minute timeout
-                cwd=self.roop_path
-            )
-            
-            if result.returncode == 0 and os.path.exists(output_path):
-                # Get file size
-                file_size = os.path.getsize(output_path)
-                
-                return {
-                    'success': True,
-                    'output_path': output_path,
-                    'metadata': {
-                        'file_size_bytes': file_size,
-                        'roop_stdout': result.stdout,
-                        'processing_method': 'roop_cpu'
-                    }
-                }
-            else:
-                error_msg = result.stderr or result.stdout or 'Unknown roop error'
-                logger.error(f"Roop failed for job {job.id}: {error_msg}")
-                return {'success': False, 'error': f'Face swap failed: {error_msg}'}
-                
-        except subprocess.TimeoutExpired:
-            return {'success': False, 'error': 'Face swap processing timed out'}
+        except TimeoutError:
+            return {'success': False, 'error': f'{kind.label} processing timed out'}
         except Exception as e:
-            logger.error(f"Error in image face swap: {e}")
+            logger.error(f"Error in {kind.label.lower()}: {e}")
             return {'success': False, 'error': str(e)}
     
-    def _process_video_face_swap(self, job: FaceSwapJob) -> Dict[str, Any]:
-        """Process video face swap using roop"""
-        if not self.roop_available:
-            return {'success': False, 'error': 'Roop not available'}
+    def _prepare_job(self, job: FaceSwapJob, kind: JobKind) -> Dict[str, Any]:
+        """Build the output path and FaceFusion arguments for a job, or an error result"""
+        if not self.facefusion_available:
+            return {'success': False, 'error': 'FaceFusion not available'}
         
-        try:
-            # Generate unique output filename
-            output_filename = f"faceswap_video_{job.id}_{uuid.uuid4().hex[:8]}.mp4"
-            output_path = os.path.join(self.output_dir, output_filename)
-            
-            # For video face swap, source is the face image, target is the video
-            if not job.target_file_path:
-                return {
-                    'success': False, 
-                    'error': 'Video face swap requires a face image and a target video.'
-                }
-            
-            # Prepare roop command for video
-            cmd = [
-                sys.executable,
-                os.path.join(self.roop_path, 'run.py'),
-                '--source', job.source_file_path,
-                '--target', job.target_file_path,
-                '--output', output_path,
-                '--execution-provider', 'cpu',  # Use CPU for compatibility
-                '--frame-processor', 'face_swapper',
-                '--keep-fps'  # Maintain original video FPS
-            ]
-            
-            # Run roop
-            logger.info(f"Running roop video command for job {job.id}")
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=600,  # 10 minute timeout for videos
-                cwd=self.roop_path
-            )
-            
-            if result.returncode == 0 and os.path.exists(output_path):
-                # Get file size
-                file_size = os.path.getsize(output_path)
-                
-                return {
-                    'success': True,
-                    'output_path': output_path,
-                    'metadata': {
-                        'file_size_bytes': file_size,
-                        'roop_stdout': result.stdout,
-                        'processing_method': 'roop_cpu_video'
-                    }
+        # Both kinds swap the source face onto a target file
+        if not job.target_file_path:
+            return {'success': False, 'error': kind.missing_target_error}
+        
+        # Job ids are unique, so they name the output file
+        output_path = os.path.join(self.output_dir, kind.output_filename.format(job.id))
+        
+        # Prepare FaceFusion arguments for headless operation
+        args = [
+            'headless-run',
+            '--source-paths', job.source_file_path,
+            '--target-path', job.target_file_path,
+            '--output-path', output_path,
+            '--temp-path', self._temp_path_for(job.target_file_path, kind.tmpfs_factor),
+            *self._facefusion_args
+        ]
+        return {'output_path': output_path, 'args': args}
+    
+    def _job_result(self, job: FaceSwapJob, kind: JobKind, output_path: str,
+                    returncode: int, output: str) -> Dict[str, Any]:
+        """Turn a FaceFusion run into a job result"""
+        if returncode == 0 and os.path.exists(output_path):
+            # Get file size
+            file_size = os.path.getsize(output_path)
+            
+            return {
+                'success': True,
+                'output_path': self._publish(output_path),
+                'metadata': {
+                    'file_size_bytes': file_size,
+                    'processing_method': kind.processing_method
                 }
-            else:
-                error_msg = result.stderr or result.stdout or 'Unknown roop error'
-                logger.error(f"Roop video failed for job {job.id}: {error_msg}")
-                return {'success': False, 'error': f'Video face swap failed: {error_msg}'}
-                
-        except subprocess.TimeoutExpired:
-            return {'success': False, 'error': 'Video face swap processing timed out'}
-        except Exception as e:
-            logger.error(f"Error in video face swap: {e}")
-            return {'success': False, 'error': str(e)}
+            }
+        else:
+            error_msg = output[-FACEFUSION_ERROR_CHARS:] or 'Unknown FaceFusion error'
+            logger.error(f"FaceFusion failed for job {job.id}: {error_msg}")
+            return {'success': False, 'error': f'{kind.label} failed: {error_msg}'}
+    
+    def _temp_path_for(self, target_path: str, factor: int) -> str:
+        """FaceFusion temp directory for a target: tmpfs if it has room, disk otherwise"""
+        if self.tmpfs_dir:
+            try:
+                if shutil.disk_usage(self.tmpfs_dir).free > factor * os.path.getsize(target_path):
+                    return self.tmpfs_dir
+            except OSError:
+                pass
+        return self.temp_dir
+    
+    def _publish(self, path: str) -> str:
+        """Move a finished output to the publish directory; returns its new path"""
+        if not self.publish_dir:
+            return path
+        
+        published_path = os.path.join(self.publish_dir, os.path.basename(path))
+        try:
+            # Same filesystem: a rename, no bytes copied at all
+            os.replace(path, published_path)
+            return published_path
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+        
+        with open(path, 'rb') as src, open(published_path, 'wb') as dst:
+            _copy_file_in_kernel(src.fileno(), dst.fileno(), os.fstat(src.fileno()).st_size)
+        os.unlink(path)
+        return published_path
     
     def get_job_status(self, job_id: int) -> Optional[FaceSwapJob]:
-        """Get job status"""
-        return FaceSwapJob.query.get(job_id)
+        """Get job status as a detached snapshot of the job"""
+        key = _job_status_key(job_id)
+        snapshot = _job_status_cache.get(key)
+        if snapshot is not None:
+            return snapshot
+        
+        job = FaceSwapJob.query.get(job_id)
+        if not job:
+            return None
+        
+        # Cache a copy outside any session, so later commits can't expire it
+        snapshot = FaceSwapJob(**{column.key: getattr(job, column.key) for column in FaceSwapJob.__table__.columns})
+        ttl = None if snapshot.status in TERMINAL_JOB_STATUSES else ACTIVE_JOB_STATUS_TTL
+        _job_status_cache.set(key, snapshot, ttl=ttl)
+        return snapshot
     
     def get_user_jobs(self, user_id: int, limit: int = 10) -> list:
         """Get user's face swap jobs"""
@@ -534,15 +616,19 @@ class FaceSwapService:
     def cleanup_old_files(self, days_old: int = 7) -> int:
         """Clean up old output files"""
         try:
-            import time
             cutoff_time = time.time() - (days_old * 24 * 60 * 60)
-            cleaned_count = 0
             
-            for filename in os.listdir(self.output_dir):
-                file_path = os.path.join(self.output_dir, filename)
-                if os.path.isfile(file_path) and os.path.getmtime(file_path) < cutoff_time:
-                    os.remove(file_path)
-                    cleaned_count += 1
+            # scandir entries carry their type and stat results, so each file
+            # costs no extra stat calls
+            with os.scandir(self.output_dir) as entries:
+                old_files = [
+                    entry.path for entry in entries
+                    if entry.is_file(follow_symlinks=False) and entry.stat().st_mtime < cutoff_time
+                ]
+            
+            # Overlap the unlinks on slow storage
+            with ThreadPoolExecutor(max_workers=CLEANUP_WORKERS) as executor:
+                cleaned_count = sum(executor.map(_remove_file, old_files))
             
             logger.info(f"Cleaned up {cleaned_count} old files")
             return cleaned_count
@@ -553,12 +639,28 @@ class FaceSwapService:
     
     def get_system_status(self) -> Dict[str, Any]:
         """Get face swap system status"""
+        counts = self._get_job_counts()
+        
         return {
-            'roop_available': self.roop_available,
-            'roop_path': self.roop_path,
+            'facefusion_available': self.facefusion_available,
+            'facefusion_path': self.facefusion_path,
             'temp_dir_exists': os.path.exists(self.temp_dir),
             'output_dir_exists': os.path.exists(self.output_dir),
-            'pending_jobs': FaceSwapJob.query.filter_by(status=JobStatus.QUEUED).count(),
-            'processing_jobs': FaceSwapJob.query.filter_by(status=JobStatus.PROCESSING).count()
+            'pending_jobs': counts.get(JobStatus.QUEUED, 0),
+            'processing_jobs': counts.get(JobStatus.PROCESSING, 0)
         }
+    
+    def _get_job_counts(self) -> Dict[JobStatus, int]:
+        """Queued and processing job counts, reused for SYSTEM_STATUS_TTL seconds"""
+        counts, expires_at = self._job_counts
+        now = time.monotonic()
+        if counts is None or expires_at < now:
+            # Both job counts from one grouped query
+            counts = dict(db.session.execute(
+                select(FaceSwapJob.status, func.count())
+                .where(FaceSwapJob.status.in_([JobStatus.QUEUED, JobStatus.PROCESSING]))
+                .group_by(FaceSwapJob.status)
+            ).all())
+            self._job_counts = (counts, now + SYSTEM_STATUS_TTL)
+        return counts
 
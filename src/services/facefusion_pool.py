@@ -0,0 +1,204 @@
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Warm workers each hold FaceFusion's models in memory, so keep the pool small
+FACEFUSION_WORKERS = int(os.getenv('FACEFUSION_WORKERS', min(os.cpu_count() or 1, 4)))
+
+# Log lines kept per command; long videos log per frame, so only the tail is
+# returned for diagnostics
+OUTPUT_TAIL_LINES = 200
+
+class _TailHandler(logging.Handler):
+    """Logging handler that keeps only the most recent lines"""
+
+    def __init__(self, max_lines: int):
+        super().__init__()
+        self.lines = deque(maxlen=max_lines)
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+def _configure_onnxruntime(intra_op_threads: int):
+    """Build FaceFusion's ONNX Runtime sessions on one shared CPU arena and a share of the cores"""
+    import onnxruntime
+    from facefusion import inference_manager
+    from facefusion.execution import create_inference_session_providers
+
+    # Every model session in this worker (detector, landmarker, recognizer,
+    # swapper, ...) draws from one arena instead of growing its own
+    onnxruntime.create_and_register_allocator(
+        onnxruntime.OrtMemoryInfo(
+            'Cpu', onnxruntime.OrtAllocatorType.ORT_ARENA_ALLOCATOR, 0, onnxruntime.OrtMemType.DEFAULT
+        ),
+        None
+    )
+
+    def create_inference_session(model_path, execution_device_id, execution_providers):
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = intra_op_threads
+        session_options.add_session_config_entry('session.use_env_allocators', '1')
+        return onnxruntime.InferenceSession(
+            model_path,
+            sess_options=session_options,
+            providers=create_inference_session_providers(execution_device_id, execution_providers)
+        )
+
+    # FaceFusion looks this up at call time when it fills its inference pools
+    inference_manager.create_inference_session = create_inference_session
+
+def _worker_main(conn, facefusion_path: str, intra_op_threads: int):
+    """Import FaceFusion once, then run headless commands sent over conn"""
+    os.environ.setdefault('OMP_NUM_THREADS', '1')
+    sys.path.insert(0, facefusion_path)
+    os.chdir(facefusion_path)
+
+    from facefusion import core
+
+    try:
+        _configure_onnxruntime(intra_op_threads)
+    except Exception as e:
+        logger.warning(f"Using FaceFusion's default ONNX Runtime sessions: {e}")
+
+    # Tail of each command's FaceFusion log, returned alongside the exit code
+    output = _TailHandler(OUTPUT_TAIL_LINES)
+    logging.getLogger('facefusion').addHandler(output)
+
+    while True:
+        try:
+            batch = conn.recv()
+        except EOFError:
+            break
+        if batch is None:
+            break
+
+        results = []
+        for args in batch:
+            output.lines.clear()
+            sys.argv = ['facefusion.py', *args]
+
+            # FaceFusion's CLI always ends in sys.exit(error_code); model
+            # inference pools stay loaded in this process between jobs
+            try:
+                core.cli()
+                returncode = 0
+            except SystemExit as e:
+                returncode = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+            except Exception as e:
+                returncode = 1
+                output.lines.append(str(e))
+            results.append((returncode, '\n'.join(output.lines)))
+
+        conn.send(results)
+
+class _Worker:
+    """One long-running FaceFusion process and its control pipe"""
+
+    def __init__(self, ctx, facefusion_path: str, intra_op_threads: int):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main, args=(child_conn, facefusion_path, intra_op_threads),
+            name='facefusion-worker', daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+    def kill(self):
+        self.process.terminate()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+class FaceFusionWorkerPool:
+    """Pool of warm FaceFusion processes that run headless jobs without a cold start"""
+
+    def __init__(self, facefusion_path: str, size: int = FACEFUSION_WORKERS):
+        self.facefusion_path = facefusion_path
+        self.size = max(size, 1)
+        # Split the cores between workers so they don't oversubscribe them
+        self.intra_op_threads = max((os.cpu_count() or 1) // self.size, 1)
+        self._ctx = multiprocessing.get_context('spawn')
+        # LIFO so the most recently used (warmest) worker is picked first
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._started = 0
+        self._closed = False
+
+    def run(self, args: list, timeout: float) -> tuple:
+        """Run one FaceFusion command, returning (returncode, output)"""
+        return self.run_batch([args], timeout)[0]
+
+    def run_batch(self, batch: list, timeout: float) -> list:
+        """Run several FaceFusion commands back to back on one worker, returning (returncode, output) for each"""
+        worker = self._acquire()
+        try:
+            worker.conn.send(batch)
+            if not worker.conn.poll(timeout):
+                # A stuck job would hold its worker forever; replace it
+                self._discard(worker, kill=True)
+                raise TimeoutError(f"FaceFusion did not finish within {timeout}s")
+            results = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            self._discard(worker, kill=True)
+            return [(1, f"FaceFusion worker exited unexpectedly: {e}")] * len(batch)
+
+        if self._closed:
+            self._discard(worker)
+        else:
+            self._idle.put(worker)
+        return results
+
+    def shutdown(self):
+        """Stop all idle workers"""
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            worker.stop()
+
+    def _acquire(self) -> _Worker:
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError('FaceFusion worker pool is shut down')
+                if self._started < self.size:
+                    self._started += 1
+                    logger.info(f"Starting FaceFusion worker {self._started}/{self.size}")
+                    return _Worker(self._ctx, self.facefusion_path, self.intra_op_threads)
+
+            # Wake up periodically in case a discarded worker freed a slot
+            try:
+                return self._idle.get(timeout=1.0)
+            except queue.Empty:
+                continue
+
+    def _discard(self, worker: _Worker, kill: bool = False):
+        if kill:
+            worker.kill()
+        else:
+            worker.stop()
+        with self._lock:
+            self._started -= 1
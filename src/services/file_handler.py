@@ -1,28 +1,122 @@
 import os
 import tempfile
 import logging
-from pathlib import Path
+import ctypes
+import errno
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Dict, Any
-import requests
 from telegram import File
 import uuid
 import mimetypes
 
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
 logger = logging.getLogger(__name__)
 
+# statx(2) flags: read only the mtime, from the cached inode without asking
+# network filesystems to resync it
+AT_FDCWD = -100
+AT_SYMLINK_NOFOLLOW = 0x100
+AT_STATX_DONT_SYNC = 0x4000
+STATX_MTIME = 0x40
+
+class _StatxTimestamp(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_int64), ('tv_nsec', ctypes.c_uint32), ('_reserved', ctypes.c_int32)]
+
+class _Statx(ctypes.Structure):
+    """struct statx up to stx_mtime, padded to the kernel's 256 bytes"""
+    _fields_ = [
+        ('stx_mask', ctypes.c_uint32), ('stx_blksize', ctypes.c_uint32),
+        ('stx_attributes', ctypes.c_uint64),
+        ('stx_nlink', ctypes.c_uint32), ('stx_uid', ctypes.c_uint32), ('stx_gid', ctypes.c_uint32),
+        ('stx_mode', ctypes.c_uint16), ('_spare0', ctypes.c_uint16),
+        ('stx_ino', ctypes.c_uint64), ('stx_size', ctypes.c_uint64), ('stx_blocks', ctypes.c_uint64),
+        ('stx_attributes_mask', ctypes.c_uint64),
+        ('stx_atime', _StatxTimestamp), ('stx_btime', _StatxTimestamp),
+        ('stx_ctime', _StatxTimestamp), ('stx_mtime', _StatxTimestamp),
+        ('_spare', ctypes.c_uint8 * 128)
+    ]
+
+def _load_statx():
+    """glibc's statx wrapper, or None off Linux / on libcs without it"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        statx = ctypes.CDLL(None, use_errno=True).statx
+    except (OSError, AttributeError):
+        return None
+    statx.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_uint, ctypes.POINTER(_Statx)]
+    statx.restype = ctypes.c_int
+    return statx
+
+_statx = _load_statx()
+
+def _statx_mtime(path: str) -> Optional[float]:
+    """A file's mtime via statx(AT_STATX_DONT_SYNC, STATX_MTIME), or None if statx can't answer"""
+    global _statx
+    if _statx is None:
+        return None
+    
+    buf = _Statx()
+    if _statx(AT_FDCWD, os.fsencode(path), AT_STATX_DONT_SYNC | AT_SYMLINK_NOFOLLOW, STATX_MTIME, ctypes.byref(buf)) != 0:
+        if ctypes.get_errno() == errno.ENOSYS:
+            # Kernel older than 4.11; stop trying
+            _statx = None
+        return None
+    if not buf.stx_mask & STATX_MTIME:
+        return None
+    return buf.stx_mtime.tv_sec + buf.stx_mtime.tv_nsec / 1e9
+
+# Threads overlapping unlinks when clearing out old uploads
+CLEANUP_WORKERS = 8
+
+# Resolved once so per-file paths are a plain concatenation with no '..' to walk
+UPLOAD_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'uploads'))
+
+# Supported file types, and how they are listed in error messages
+SUPPORTED_FILE_TYPES = {
+    'image': frozenset({'.jpg', '.jpeg', '.png', '.webp'}),
+    'video': frozenset({'.mp4', '.mov', '.avi', '.mkv'})
+}
+SUPPORTED_FILE_TYPE_NAMES = {
+    file_type: ', '.join(sorted(extensions)) for file_type, extensions in SUPPORTED_FILE_TYPES.items()
+}
+
+# Seconds to wait for Telegram file data; PTB's 5s default is too short for
+# videos near the upload limit
+DOWNLOAD_READ_TIMEOUT = 60
+
+# Formats validate_image_file accepts; Image.open only tries these plugins
+# and reads just the header, the pixels are never decoded
+IMAGE_VALIDATION_FORMATS = ('JPEG', 'PNG', 'WEBP')
+
+def _remove_upload(path: str) -> bool:
+    """Delete an upload, returning whether it was removed"""
+    try:
+        os.unlink(path)
+        return True
+    except OSError as e:
+        logger.warning(f"Could not remove {path}: {e}")
+        return False
+
 class FileHandler:
     """Service for handling file uploads and downloads"""
     
     def __init__(self):
-        self.upload_dir = os.path.join(os.path.dirname(__file__), '../../uploads')
+        self.upload_dir = UPLOAD_DIR
         self.max_file_size = int(os.getenv('MAX_FILE_SIZE_MB', 50)) * 1024 * 1024  # Convert MB to bytes
         
         # Ensure upload directory exists
         os.makedirs(self.upload_dir, exist_ok=True)
         
         # Supported file types
-        self.supported_image_types = {'.jpg', '.jpeg', '.png', '.webp'}
-        self.supported_video_types = {'.mp4', '.mov', '.avi', '.mkv'}
+        self.supported_image_types = SUPPORTED_FILE_TYPES['image']
+        self.supported_video_types = SUPPORTED_FILE_TYPES['video']
     
     async def download_telegram_file(self, file: File, file_type: str = 'image') -> Dict[str, Any]:
         """Download file from Telegram servers"""
@@ -40,10 +134,10 @@ class FileHandler:
                 file_extension = '.jpg' if file_type == 'image' else '.mp4'
             
             filename = f"{file_type}_{uuid.uuid4().hex[:8]}{file_extension}"
-            local_path = os.path.join(self.upload_dir, filename)
+            local_path = f"{self.upload_dir}{os.sep}{filename}"
             
-            # Download the file
-            await file.download_to_drive(local_path)
+            # Download the file; PTB buffers the body and writes it in one call
+            await file.download_to_drive(local_path, read_timeout=DOWNLOAD_READ_TIMEOUT)
             
             # Verify file was downloaded
             if not os.path.exists(local_path):
@@ -76,39 +170,29 @@ class FileHandler:
         if not file_path:
             return None
         
-        path = Path(file_path)
-        return path.suffix.lower()
+        # Same result as Path(file_path).suffix.lower() without building a Path
+        name = file_path[file_path.rfind('/') + 1:]
+        dot = name.rfind('.')
+        if dot <= 0 or dot == len(name) - 1:
+            return ''
+        return name[dot:].lower()
     
     def _is_supported_file_type(self, file_path: str, expected_type: str) -> bool:
         """Check if file type is supported"""
-        extension = self._get_file_extension(file_path)
-        
-        if expected_type == 'image':
-            return extension in self.supported_image_types
-        elif expected_type == 'video':
-            return extension in self.supported_video_types
-        
-        return False
+        return self._get_file_extension(file_path) in SUPPORTED_FILE_TYPES.get(expected_type, ())
     
     def _get_supported_types(self, file_type: str) -> str:
         """Get supported file types as string"""
-        if file_type == 'image':
-            return ', '.join(self.supported_image_types)
-        elif file_type == 'video':
-            return ', '.join(self.supported_video_types)
-        return ''
+        return SUPPORTED_FILE_TYPE_NAMES.get(file_type, '')
     
     def validate_image_file(self, file_path: str) -> Dict[str, Any]:
         """Validate image file"""
+        if Image is None:
+            return {'valid': False, 'error': 'Image validation unavailable: Pillow is not installed'}
+        
         try:
-            from PIL import Image
-            
-            # Check if file exists
-            if not os.path.exists(file_path):
-                return {'valid': False, 'error': 'File not found'}
-            
             # Try to open with PIL
-            with Image.open(file_path) as img:
+            with Image.open(file_path, formats=IMAGE_VALIDATION_FORMATS) as img:
                 # Check image dimensions
                 width, height = img.size
                 
@@ -129,6 +213,8 @@ class FileHandler:
                     'mode': img.mode
                 }
                 
+        except FileNotFoundError:
+            return {'valid': False, 'error': 'File not found'}
         except Exception as e:
             return {'valid': False, 'error': f'Invalid image file: {str(e)}'}
     
@@ -174,15 +260,26 @@ class FileHandler:
     def cleanup_old_uploads(self, hours_old: int = 24) -> int:
         """Clean up old uploaded files"""
         try:
-            import time
             cutoff_time = time.time() - (hours_old * 60 * 60)
-            cleaned_count = 0
+            old_files = []
+            
+            # scandir entries carry their type; statx fetches only the mtime
+            with os.scandir(self.upload_dir) as entries:
+                for entry in entries:
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    
+                    mtime = _statx_mtime(entry.path)
+                    if mtime is None:
+                        mtime = entry.stat(follow_symlinks=False).st_mtime
+                    
+                    if mtime < cutoff_time:
+                        old_files.append(entry.path)
             
-            for filename in os.listdir(self.upload_dir):
-                file_path = os.path.join(self.upload_dir, filename)
-                if os.path.isfile(file_path) and os.path.getmtime(file_path) < cutoff_time:
-                    if self.cleanup_file(file_path):
-                        cleaned_count += 1
+            # Overlap the unlinks on slow storage; one summary line instead of
+            # a log line per file
+            with ThreadPoolExecutor(max_workers=CLEANUP_WORKERS) as executor:
+                cleaned_count = sum(executor.map(_remove_upload, old_files))
             
             logger.info(f"Cleaned up {cleaned_count} old upload files")
             return cleaned_count
@@ -222,14 +319,14 @@ class FileHandler:
     def get_storage_stats(self) -> Dict[str, Any]:
         """Get storage statistics"""
         try:
-            total_size = 0
-            file_count = 0
-            
-            for filename in os.listdir(self.upload_dir):
-                file_path = os.path.join(self.upload_dir, filename)
-                if os.path.isfile(file_path):
-                    total_size += os.path.getsize(file_path)
-                    file_count += 1
+            # One pass over the directory; scandir entries carry their type
+            with os.scandir(self.upload_dir) as entries:
+                sizes = [
+                    entry.stat(follow_symlinks=False).st_size
+                    for entry in entries if entry.is_file(follow_symlinks=False)
+                ]
+            total_size = sum(sizes)
+            file_count = len(sizes)
             
             return {
                 'total_files': file_count,
@@ -1,11 +1,16 @@
-import uuid
+import secrets
 from datetime import datetime, timezone, timedelta
 from src.models.database import db, User, Invite, InviteStatus, CreditType, CreditSource
 from src.services.credit_service import CreditService
+from sqlalchemy import case, func, update
+from sqlalchemy.exc import IntegrityError
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Fresh codes to try if a generated invite code is already taken
+INVITE_CODE_ATTEMPTS = 5
+
 class InviteService:
     """Service for managing user invitations"""
     
@@ -15,21 +20,24 @@ class InviteService:
     def create_invite(self, inviter_user_id: int, expires_in_days: int = 30) -> str:
         """Create a new invite code for a user"""
         try:
-            # Generate unique invite code
-            invite_code = str(uuid.uuid4())[:8].upper()
-            
-            # Ensure uniqueness
-            while Invite.query.filter_by(invite_code=invite_code).first():
-                invite_code = str(uuid.uuid4())[:8].upper()
-            
-            # Create invite record
-            invite = Invite(
-                inviter_user_id=inviter_user_id,
-                invite_code=invite_code,
-                expires_at=datetime.now(timezone.utc) + timedelta(days=expires_in_days)
-            )
-            
-            db.session.add(invite)
+            # invite_code is UNIQUE, so rather than checking before every
+            # insert, regenerate the code on the rare collision. The savepoint
+            # rolls back only the failed INSERT, not the caller's pending work.
+            for attempt in range(INVITE_CODE_ATTEMPTS):
+                invite_code = secrets.token_hex(4).upper()
+                invite = Invite(
+                    inviter_user_id=inviter_user_id,
+                    invite_code=invite_code,
+                    expires_at=datetime.now(timezone.utc) + timedelta(days=expires_in_days)
+                )
+                
+                try:
+                    with db.session.begin_nested():
+                        db.session.add(invite)
+                    break
+                except IntegrityError:
+                    if attempt == INVITE_CODE_ATTEMPTS - 1:
+                        raise
             
             # Update user's total invites sent
             user = User.query.get(inviter_user_id)
@@ -68,7 +76,7 @@ class InviteService:
                 return {'success': False, 'reason': 'Cannot invite yourself'}
             
             # Check if user already exists (shouldn't happen in normal flow)
-            invitee = User.query.get(invitee_user_id)
+            invitee = db.session.get(User, invitee_user_id)
             if not invitee:
                 return {'success': False, 'reason': 'Invitee user not found'}
             
@@ -77,29 +85,32 @@ class InviteService:
             invite.status = InviteStatus.ACCEPTED
             invite.accepted_at = datetime.now(timezone.utc)
             
-            # Award credits to inviter
-            self.credit_service.add_credits(
-                user_id=invite.inviter_user_id,
-                amount=invite.credits_awarded,
-                credit_type=CreditType.EARNED,
-                source=CreditSource.INVITE,
-                source_reference=f"invite_{invite_code}"
-            )
+            # Award credits to inviter and bonus credits to invitee in one insert
+            self.credit_service.add_credits_bulk([
+                {
+                    'user_id': invite.inviter_user_id,
+                    'amount': invite.credits_awarded,
+                    'credit_type': CreditType.EARNED,
+                    'source': CreditSource.INVITE,
+                    'source_reference': f"invite_{invite_code}"
+                },
+                {
+                    'user_id': invitee_user_id,
+                    'amount': 1,  # Bonus credit for joining via invite
+                    'credit_type': CreditType.BONUS,
+                    'source': CreditSource.INVITE,
+                    'source_reference': f"invited_by_{invite_code}"
+                }
+            ], commit=False)
             
-            # Award bonus credits to invitee
-            self.credit_service.add_credits(
-                user_id=invitee_user_id,
-                amount=1,  # Bonus credit for joining via invite
-                credit_type=CreditType.BONUS,
-                source=CreditSource.INVITE,
-                source_reference=f"invited_by_{invite_code}"
+            # Update inviter's successful invites count without loading the row
+            db.session.execute(
+                update(User)
+                .where(User.id == invite.inviter_user_id)
+                .values(total_invites_accepted=User.total_invites_accepted + 1)
+                .execution_options(synchronize_session=False)
             )
             
-            # Update inviter's successful invites count
-            inviter = User.query.get(invite.inviter_user_id)
-            if inviter:
-                inviter.total_invites_accepted += 1
-            
             db.session.commit()
             
             logger.info(f"Processed invite {invite_code}: inviter {invite.inviter_user_id} -> invitee {invitee_user_id}")
@@ -149,21 +160,16 @@ class InviteService:
     def get_invite_statistics(self) -> dict:
         """Get system-wide invite statistics"""
         try:
-            total_invites = Invite.query.count()
-            pending_invites = Invite.query.filter_by(status=InviteStatus.PENDING).count()
-            accepted_invites = Invite.query.filter_by(status=InviteStatus.ACCEPTED).count()
-            expired_invites = Invite.query.filter_by(status=InviteStatus.EXPIRED).count()
-            
-            # Top inviters
-            from sqlalchemy import func
-            top_inviters = db.session.query(
-                User.telegram_user_id,
-                User.first_name,
-                User.username,
-                func.count(Invite.id).label('invite_count')
-            ).join(Invite, User.id == Invite.inviter_user_id).filter(
-                Invite.status == InviteStatus.ACCEPTED
-            ).group_by(User.id).order_by(func.count(Invite.id).desc()).limit(10).all()
+            # One scan with conditional counts instead of four COUNT queries
+            total_invites, pending_invites, accepted_invites, expired_invites = db.session.query(
+                func.count(Invite.id),
+                func.sum(case((Invite.status == InviteStatus.PENDING, 1), else_=0)),
+                func.sum(case((Invite.status == InviteStatus.ACCEPTED, 1), else_=0)),
+                func.sum(case((Invite.status == InviteStatus.EXPIRED, 1), else_=0))
+            ).one()
+            pending_invites = pending_invites or 0
+            accepted_invites = accepted_invites or 0
+            expired_invites = expired_invites or 0
             
             return {
                 'total_invites': total_invites,
@@ -171,19 +177,32 @@ class InviteService:
                 'accepted_invites': accepted_invites,
                 'expired_invites': expired_invites,
                 'acceptance_rate': (accepted_invites / total_invites * 100) if total_invites > 0 else 0,
-                'top_inviters': [
-                    {
-                        'telegram_user_id': inviter.telegram_user_id,
-                        'name': inviter.first_name or inviter.username or 'Unknown',
-                        'invite_count': inviter.invite_count
-                    } for inviter in top_inviters
-                ]
+                'top_inviters': self.get_top_inviters()
             }
             
         except Exception as e:
             logger.error(f"Error getting invite statistics: {e}")
             return {}
     
+    def get_top_inviters(self, limit: int = 10) -> list:
+        """Get the users with the most accepted invites"""
+        top_inviters = db.session.query(
+            User.telegram_user_id,
+            User.first_name,
+            User.username,
+            func.count(Invite.id).label('invite_count')
+        ).join(Invite, User.id == Invite.inviter_user_id).filter(
+            Invite.status == InviteStatus.ACCEPTED
+        ).group_by(User.id).order_by(func.count(Invite.id).desc()).limit(limit).all()
+        
+        return [
+            {
+                'telegram_user_id': inviter.telegram_user_id,
+                'name': inviter.first_name or inviter.username or 'Unknown',
+                'invite_count': inviter.invite_count
+            } for inviter in top_inviters
+        ]
+    
     def validate_invite_code(self, invite_code: str) -> dict:
         """Validate an invite code without processing it"""
         invite = self.get_invite_by_code(invite_code)
@@ -210,18 +229,25 @@ class InviteService:
         if not user:
             return None
         
-        invites = self.get_user_invites(user_id)
-        pending_invites = [inv for inv in invites if inv.status == InviteStatus.PENDING]
-        accepted_invites = [inv for inv in invites if inv.status == InviteStatus.ACCEPTED]
-        expired_invites = [inv for inv in invites if inv.status == InviteStatus.EXPIRED]
+        # Count per status in the database instead of loading every invite
+        counts = dict(
+            db.session.query(Invite.status, func.count(Invite.id))
+            .filter(Invite.inviter_user_id == user_id)
+            .group_by(Invite.status)
+            .all()
+        )
+        pending_invites = counts.get(InviteStatus.PENDING, 0)
+        accepted_invites = counts.get(InviteStatus.ACCEPTED, 0)
+        expired_invites = counts.get(InviteStatus.EXPIRED, 0)
+        total_invites = sum(counts.values())
         
         return {
-            'total_sent': len(invites),
-            'pending': len(pending_invites),
-            'accepted': len(accepted_invites),
-            'expired': len(expired_invites),
-            'acceptance_rate': (len(accepted_invites) / len(invites) * 100) if invites else 0,
-            'credits_earned_from_invites': len(accepted_invites) * 1  # Assuming 1 credit per invite
+            'total_sent': total_invites,
+            'pending': pending_invites,
+            'accepted': accepted_invites,
+            'expired': expired_invites,
+            'acceptance_rate': (accepted_invites / total_invites * 100) if total_invites else 0,
+            'credits_earned_from_invites': accepted_invites * 1  # Assuming 1 credit per invite
         }
     
     def cancel_invite(self, invite_code: str, user_id: int) -> bool:
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import os
+from functools import lru_cache
+from telegram import Bot
+from src.models.database import db, FaceSwapJob, JobStatus, JobType, User
+
+logger = logging.getLogger(__name__)
+
+# Redis URL for the face swap queue; unset runs face swaps in the bot process
+FACE_SWAP_QUEUE_URL = os.getenv('FACE_SWAP_QUEUE_URL')
+
+# Workers drain the premium queue first: rq worker faceswap-high faceswap
+FACE_SWAP_QUEUE = 'faceswap'
+FACE_SWAP_PRIORITY_QUEUE = 'faceswap-high'
+
+# Long enough for a full image batch or one video
+FACE_SWAP_JOB_TIMEOUT = 3600
+FACE_SWAP_RESULT_TTL = 3600
+
+@lru_cache(maxsize=1)
+def _get_queues():
+    """RQ queues keyed by priority, or None when the queue is not configured"""
+    if not FACE_SWAP_QUEUE_URL:
+        return None
+    try:
+        from redis import Redis
+        from rq import Queue
+    except ImportError:
+        logger.warning("FACE_SWAP_QUEUE_URL is set but rq is not installed, face swaps run in the bot process")
+        return None
+
+    connection = Redis.from_url(FACE_SWAP_QUEUE_URL)
+    return {
+        False: Queue(FACE_SWAP_QUEUE, connection=connection),
+        True: Queue(FACE_SWAP_PRIORITY_QUEUE, connection=connection)
+    }
+
+def enqueue_face_swap_job(job_id: int, chat_id: int, priority: bool = False) -> bool:
+    """Queue a face swap job for a worker; returns False if it must run in-process"""
+    queues = _get_queues()
+    if queues is None:
+        return False
+
+    try:
+        queues[priority].enqueue(
+            run_face_swap_job, job_id, chat_id,
+            job_id=f"faceswap-{job_id}",
+            job_timeout=FACE_SWAP_JOB_TIMEOUT,
+            result_ttl=FACE_SWAP_RESULT_TTL
+        )
+    except Exception as e:
+        logger.error(f"Error enqueueing face swap job {job_id}: {e}")
+        return False
+
+    logger.info(f"Enqueued face swap job {job_id} on {queues[priority].name}")
+    return True
+
+@lru_cache(maxsize=1)
+def _get_worker_services():
+    """Services reused across jobs, so FaceFusion stays warm in the worker"""
+    from src.main import app
+    from src.services.face_swap_service import FaceSwapService
+    from src.services.file_handler import FileHandler
+
+    with app.app_context():
+        return app, FaceSwapService(), FileHandler()
+
+def run_face_swap_job(job_id: int, chat_id: int):
+    """RQ task: process a face swap job and send the result to the user's chat"""
+    app, face_swap_service, file_handler = _get_worker_services()
+
+    with app.app_context():
+        job = FaceSwapJob.query.get(job_id)
+        if not job:
+            logger.error(f"Queued face swap job {job_id} not found")
+            return
+        if job.status != JobStatus.QUEUED:
+            # Already picked up as part of another worker's image batch
+            return
+
+        if job.job_type == JobType.IMAGE:
+            # Run other waiting image jobs on the same worker round trip
+            processed = face_swap_service.process_image_job_batch(job_id)
+        else:
+            processed = [(job, face_swap_service.process_face_swap_job(job_id))]
+
+        # Jobs another worker claimed first are delivered by that worker
+        processed = [(job, result) for job, result in processed if result.get('claimed', True)]
+
+        # Drained jobs were sent from private chats, whose id is the user's
+        chat_ids = dict(
+            db.session.query(FaceSwapJob.id, User.telegram_user_id)
+            .join(User, User.id == FaceSwapJob.user_id)
+            .filter(FaceSwapJob.id.in_([job.id for job, _ in processed]))
+            .all()
+        )
+        chat_ids[job_id] = chat_id
+        deliveries = [
+            (job.id, chat_ids[job.id], job.job_type, job.source_file_path, job.target_file_path, result)
+            for job, result in processed
+        ]
+
+    for delivered_job_id, delivered_chat_id, job_type, source_path, target_path, result in deliveries:
+        try:
+            asyncio.run(_send_result(delivered_chat_id, delivered_job_id, job_type, result))
+        except Exception as e:
+            logger.error(f"Error sending face swap job {delivered_job_id} result: {e}")
+        finally:
+            file_handler.cleanup_file(source_path)
+            if target_path:
+                file_handler.cleanup_file(target_path)
+
+    return {delivered_job_id: result['success'] for delivered_job_id, *_, result in deliveries}
+
+async def _send_result(chat_id: int, job_id: int, job_type: JobType, result: dict):
+    """Deliver a finished job to the chat it came from"""
+    async with Bot(os.getenv('TELEGRAM_BOT_TOKEN')) as bot:
+        if not result['success']:
+            label = 'Video face swap' if job_type == JobType.VIDEO else 'Face swap'
+            await bot.send_message(chat_id, f"❌ {label} failed: {result['error']}")
+        elif job_type == JobType.VIDEO:
+            with open(result['output_path'], 'rb') as video_file:
+                await bot.send_video(
+                    chat_id, video=video_file,
+                    caption=f"✅ Video face swap completed!\nJob ID: {job_id}"
+                )
+        else:
+            with open(result['output_path'], 'rb') as photo_file:
+                await bot.send_photo(
+                    chat_id, photo=photo_file,
+                    caption=f"✅ Face swap completed!\nJob ID: {job_id}"
+                )
@@ -95,7 +95,8 @@ class PaymentService:
                 amount=credits_to_add,
                 credit_type=CreditType.PURCHASED,
                 source=CreditSource.PURCHASE,
-                source_reference=f"telegram_stars_{transaction.id}"
+                source_reference=f"telegram_stars_{transaction.id}",
+                commit=False
             )
             
             # Update transaction status
@@ -115,6 +116,7 @@ class PaymentService:
             }
             
         except Exception as e:
+            db.session.rollback()
             logger.error(f"Error processing Telegram Stars payment: {e}")
             return {'success': False, 'error': str(e)}
     
@@ -158,7 +160,8 @@ class PaymentService:
                 amount=credits_to_add,
                 credit_type=CreditType.PURCHASED,
                 source=CreditSource.PURCHASE,
-                source_reference=f"upi_{transaction.id}"
+                source_reference=f"upi_{transaction.id}",
+                commit=False
             )
             
             # Update transaction status
@@ -179,6 +182,7 @@ class PaymentService:
             }
             
         except Exception as e:
+            db.session.rollback()
             logger.error(f"Error processing UPI payment: {e}")
             return {'success': False, 'error': str(e)}
     
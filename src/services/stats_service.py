@@ -0,0 +1,77 @@
+from src.models.database import db, User, Invite, FaceSwapJob, UserStatus, InviteStatus, JobStatus
+from src.services.credit_service import CreditService
+from src.services.invite_service import InviteService
+from sqlalchemy import func, select, true
+import logging
+
+logger = logging.getLogger(__name__)
+
+def _count_where(condition):
+    # COUNT(*) FILTER (WHERE ...): native on PostgreSQL and SQLite >= 3.30,
+    # and 0 rather than NULL on an empty table
+    return func.count().filter(condition)
+
+class StatsService:
+    """Service for system-wide dashboard statistics"""
+
+    def __init__(self):
+        self.credit_service = CreditService()
+        self.invite_service = InviteService()
+
+    def get_system_counts(self) -> dict:
+        """Get user, invite and job counts in a single query"""
+        users = select(
+            func.count(User.id).label('users_total'),
+            _count_where(User.status == UserStatus.ACTIVE).label('users_active'),
+            _count_where(User.status == UserStatus.SUSPENDED).label('users_suspended'),
+            _count_where(User.status == UserStatus.BANNED).label('users_banned')
+        ).subquery()
+        invites = select(
+            func.count(Invite.id).label('invites_total'),
+            _count_where(Invite.status == InviteStatus.PENDING).label('invites_pending'),
+            _count_where(Invite.status == InviteStatus.ACCEPTED).label('invites_accepted'),
+            _count_where(Invite.status == InviteStatus.EXPIRED).label('invites_expired')
+        ).subquery()
+        jobs = select(
+            func.count(FaceSwapJob.id).label('jobs_total'),
+            _count_where(FaceSwapJob.status == JobStatus.COMPLETED).label('jobs_completed')
+        ).subquery()
+
+        # Each subquery is one row, so the cross join is one row too; the
+        # explicit ON TRUE joins keep SQLAlchemy's cartesian product lint quiet
+        row = db.session.execute(
+            select(users, invites, jobs).select_from(users.join(invites, true()).join(jobs, true()))
+        ).mappings().one()
+        return {key: value or 0 for key, value in row.items()}
+
+    def get_dashboard_stats(self) -> dict:
+        """Get the statistics shown on the admin dashboard"""
+        counts = self.get_system_counts()
+
+        total_invites = counts['invites_total']
+        accepted_invites = counts['invites_accepted']
+        total_jobs = counts['jobs_total']
+        completed_jobs = counts['jobs_completed']
+
+        return {
+            'users': {
+                'total': counts['users_total'],
+                'active': counts['users_active'],
+                'suspended': counts['users_suspended'],
+                'banned': counts['users_banned']
+            },
+            'credits': self.credit_service.get_credit_statistics(),
+            'invites': {
+                'total_invites': total_invites,
+                'pending_invites': counts['invites_pending'],
+                'accepted_invites': accepted_invites,
+                'expired_invites': counts['invites_expired'],
+                'acceptance_rate': (accepted_invites / total_invites * 100) if total_invites > 0 else 0,
+                'top_inviters': self.invite_service.get_top_inviters()
+            },
+            'jobs': {
+                'total': total_jobs,
+                'completed': completed_jobs,
+                'success_rate': (completed_jobs / total_jobs * 100) if total_jobs > 0 else 0
+            }
+        }
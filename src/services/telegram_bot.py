@@ -1,18 +1,22 @@
 import logging
 import os
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from functools import cached_property, lru_cache
+from flask import current_app
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
 from telegram.constants import ParseMode
 from src.models.database import db, User, Credit, CreditType, CreditSource, UserStatus
 from src.services.user_service import UserService
 from src.services.credit_service import CreditService
 from src.services.invite_service import InviteService
-from src.services.face_swap_service import FaceSwapService
 from src.services.file_handler import FileHandler
 from src.services.payment_service import PaymentService
+from src.services.job_queue import enqueue_face_swap_job
 from src.models.database import JobType
 import uuid
 import asyncio
+import orjson
+import threading
 
 # Configure logging
 logging.basicConfig(
@@ -21,6 +25,30 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Long polling timeout (seconds): getUpdates blocks server-side until an
+# update arrives instead of returning empty responses in a tight loop
+POLLING_TIMEOUT = 20
+
+# Webhook updates processed concurrently on the dispatch loop, and how many
+# may wait before the webhook starts answering 503
+DISPATCH_CONCURRENCY = 256
+DISPATCH_QUEUE_SIZE = 1000
+
+@lru_cache(maxsize=1)
+def get_bot():
+    """Get the shared bot service, creating it on first use (needs an app context)"""
+    token = os.getenv('TELEGRAM_BOT_TOKEN')
+    if not token:
+        logger.warning("TELEGRAM_BOT_TOKEN not found in environment variables")
+        return None
+    
+    bot = TelegramBotService(
+        token=token,
+        app_context=current_app._get_current_object().app_context
+    )
+    logger.info("Telegram bot service initialized")
+    return bot
+
 class TelegramBotService:
     """Telegram bot service for face swap bot"""
     
@@ -29,11 +57,15 @@ class TelegramBotService:
         self.app_context = app_context
         self.application = None
         
+        # Webhook updates run on a dedicated event loop thread
+        self._loop = None
+        self._loop_lock = threading.Lock()
+        self._dispatch_queue = None
+        
         # Initialize services
         self.user_service = UserService()
         self.credit_service = CreditService()
         self.invite_service = InviteService()
-        self.face_swap_service = FaceSwapService()
         self.file_handler = FileHandler()
         self.payment_service = PaymentService()
         
@@ -77,6 +109,15 @@ By continuing, you agree to these terms and confirm you will use this service re
 Do you agree to these guidelines?
         """
     
+    @cached_property
+    def face_swap_service(self):
+        """Face swap service, built on the first photo or video"""
+        # Web processes that only call get_bot() (bot info, webhook intake)
+        # never start FaceFusion workers, create its directories or probe
+        # execution providers
+        from src.services.face_swap_service import FaceSwapService
+        return FaceSwapService()
+    
     def setup_handlers(self):
         """Setup bot command and message handlers"""
         if not self.application:
@@ -332,8 +373,13 @@ Transaction ID: {invoice['transaction_id']}
                         f"This may take a few minutes. I'll send you the result when it's ready!"
                     )
                     
-                    # Process the job (in a real deployment, this would be async)
-                    result = self.face_swap_service.process_face_swap_job(job.id)
+                    # A queue worker sends the result and removes the uploads
+                    if enqueue_face_swap_job(job.id, update.effective_chat.id, priority=user.is_premium):
+                        self.user_states.pop(user.id, None)
+                        return
+                    
+                    # Process the job without blocking other updates
+                    result = await self.face_swap_service.process_face_swap_job_async(job.id)
                     
                     if result['success']:
                         # Send the result
@@ -419,8 +465,13 @@ Transaction ID: {invoice['transaction_id']}
                     f"This may take several minutes. I'll send you the result when it's ready!"
                 )
                 
-                # Process the job
-                result = self.face_swap_service.process_face_swap_job(job.id)
+                # A queue worker sends the result and removes the uploads
+                if enqueue_face_swap_job(job.id, update.effective_chat.id, priority=user.is_premium):
+                    self.user_states.pop(user.id, None)
+                    return
+                
+                # Process the job without blocking other updates
+                result = await self.face_swap_service.process_face_swap_job_async(job.id)
                 
                 if result['success']:
                     # Send the result
@@ -685,13 +736,21 @@ Share this link with friends to earn credits when they sign up and agree to our
         await update.message.reply_text(help_text, parse_mode=ParseMode.MARKDOWN)
     
     def run_polling(self):
-        """Run the bot in polling mode"""
+        """Run the bot in long polling mode"""
         try:
             self.application = Application.builder().token(self.token).build()
             self.setup_handlers()
             
+            # Polling usually runs on a background thread, which has no event loop
+            # and cannot install signal handlers
+            asyncio.set_event_loop(asyncio.new_event_loop())
+            
             logger.info("Starting Telegram bot in polling mode...")
-            self.application.run_polling(allowed_updates=Update.ALL_TYPES)
+            self.application.run_polling(
+                allowed_updates=Update.ALL_TYPES,
+                timeout=POLLING_TIMEOUT,
+                stop_signals=None
+            )
             
         except Exception as e:
             logger.error(f"Error running bot: {e}")
@@ -711,4 +770,71 @@ Share this link with friends to earn credits when they sign up and agree to our
             
         except Exception as e:
             logger.error(f"Error running bot webhook: {e}")
-
+    
+    def dispatch(self, raw_update: bytes) -> bool:
+        """Queue a raw webhook update for processing; False if the queue is full"""
+        loop = self._get_dispatch_loop()
+        return asyncio.run_coroutine_threadsafe(self._enqueue(raw_update), loop).result()
+    
+    def _get_dispatch_loop(self):
+        """Start the dispatch event loop thread and Application on first use"""
+        with self._loop_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='telegram-dispatch', daemon=True).start()
+                
+                self.application = Application.builder().token(self.token).updater(None).build()
+                self.setup_handlers()
+                asyncio.run_coroutine_threadsafe(self._start_application(), loop).result()
+                
+                self._loop = loop
+                logger.info("Telegram webhook dispatch loop started")
+            return self._loop
+    
+    async def _start_application(self):
+        self._dispatch_queue = asyncio.Queue(maxsize=DISPATCH_QUEUE_SIZE)
+        await self.application.initialize()
+        await self.application.start()
+        for _ in range(DISPATCH_CONCURRENCY):
+            asyncio.create_task(self._dispatch_worker())
+    
+    async def _enqueue(self, raw_update: bytes) -> bool:
+        try:
+            self._dispatch_queue.put_nowait(raw_update)
+            return True
+        except asyncio.QueueFull:
+            return False
+    
+    async def _dispatch_worker(self):
+        while True:
+            raw_update = await self._dispatch_queue.get()
+            try:
+                # Parsing happens here, off the request thread, exactly once
+                update_data = orjson.loads(raw_update)
+                logger.debug(f"Processing update {update_data.get('update_id')}")
+                update = Update.de_json(update_data, self.application.bot)
+                await self.application.process_update(update)
+            except Exception as e:
+                # Never let one bad update kill the worker
+                logger.error(f"Error processing webhook update: {e}")
+            finally:
+                self._dispatch_queue.task_done()
+    
+    def set_webhook(self, webhook_url: str, secret_token: str = None) -> bool:
+        """Register the webhook URL with Telegram"""
+        async def _set_webhook():
+            async with Bot(self.token) as bot:
+                return await bot.set_webhook(
+                    url=webhook_url,
+                    secret_token=secret_token,
+                    allowed_updates=Update.ALL_TYPES
+                )
+        
+        try:
+            result = asyncio.run(_set_webhook())
+            logger.info(f"Telegram webhook set to {webhook_url}")
+            return result
+            
+        except Exception as e:
+            logger.error(f"Error setting Telegram webhook: {e}")
+            return False
@@ -1,6 +1,8 @@
 from datetime import datetime, timezone
-from src.models.database import db, User, Credit, CreditType, CreditSource, UserStatus
+from src.models.database import db, User, Credit, CreditType, CreditSource, UserStatus, FaceSwapJob, JobStatus
+from sqlalchemy import case, func
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 import logging
 
 logger = logging.getLogger(__name__)
@@ -143,10 +145,45 @@ class UserService:
     
     def get_user_stats(self, user_id: int) -> dict:
         """Get comprehensive user statistics"""
-        user = self.get_user_by_id(user_id)
+        user = User.query.options(selectinload(User.face_swap_jobs)).filter_by(id=user_id).first()
         if not user:
             return None
         
+        return self._build_user_stats(
+            user,
+            current_credits=user.get_active_credits(),
+            total_jobs=len(user.face_swap_jobs),
+            completed_jobs=len([job for job in user.face_swap_jobs if job.status.value == 'completed'])
+        )
+    
+    def get_users_with_stats(self, limit: int = 50, offset: int = 0, status: UserStatus = None) -> list:
+        """Get a page of users with their statistics (one query per aggregate, not per user)"""
+        users = self.search_users(status=status, limit=limit, offset=offset)
+        user_ids = [user.id for user in users]
+        if not user_ids:
+            return []
+        
+        credits = User.active_credits_for(user_ids)
+        
+        job_rows = db.session.query(
+            FaceSwapJob.user_id,
+            func.count(FaceSwapJob.id),
+            func.count().filter(FaceSwapJob.status == JobStatus.COMPLETED)
+        ).filter(FaceSwapJob.user_id.in_(user_ids)).group_by(FaceSwapJob.user_id).all()
+        job_counts = {user_id: (total, completed) for user_id, total, completed in job_rows}
+        
+        return [
+            self._build_user_stats(
+                user,
+                current_credits=credits.get(user.id, 0),
+                total_jobs=job_counts.get(user.id, (0, 0))[0],
+                completed_jobs=job_counts.get(user.id, (0, 0))[1]
+            )
+            for user in users
+        ]
+    
+    def _build_user_stats(self, user: User, current_credits: int, total_jobs: int, completed_jobs: int) -> dict:
+        """Shape user statistics for API responses"""
         return {
             'user_id': user.id,
             'telegram_user_id': user.telegram_user_id,
@@ -157,11 +194,11 @@ class UserService:
             'status': user.status.value,
             'total_credits_earned': user.total_credits_earned,
             'total_credits_spent': user.total_credits_spent,
-            'current_credits': user.get_active_credits(),
+            'current_credits': current_credits,
             'total_invites_sent': user.total_invites_sent,
             'total_invites_accepted': user.total_invites_accepted,
-            'total_face_swap_jobs': len(user.face_swap_jobs),
-            'completed_jobs': len([job for job in user.face_swap_jobs if job.status.value == 'completed']),
+            'total_face_swap_jobs': total_jobs,
+            'completed_jobs': completed_jobs,
             'agreed_to_terms': user.agreed_to_terms,
             'terms_agreed_at': user.terms_agreed_at
         }
@@ -187,15 +224,18 @@ class UserService:
     
     def get_user_count(self) -> dict:
         """Get user count statistics"""
-        total_users = User.query.count()
-        active_users = User.query.filter_by(status=UserStatus.ACTIVE).count()
-        suspended_users = User.query.filter_by(status=UserStatus.SUSPENDED).count()
-        banned_users = User.query.filter_by(status=UserStatus.BANNED).count()
+        # One scan with conditional counts instead of four COUNT queries
+        total_users, active_users, suspended_users, banned_users = db.session.query(
+            func.count(User.id),
+            func.sum(case((User.status == UserStatus.ACTIVE, 1), else_=0)),
+            func.sum(case((User.status == UserStatus.SUSPENDED, 1), else_=0)),
+            func.sum(case((User.status == UserStatus.BANNED, 1), else_=0))
+        ).one()
         
         return {
             'total': total_users,
-            'active': active_users,
-            'suspended': suspended_users,
-            'banned': banned_users
+            'active': active_users or 0,
+            'suspended': suspended_users or 0,
+            'banned': banned_users or 0
         }
 
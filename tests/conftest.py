@@ -0,0 +1,48 @@
+import os
+
+# Tests use the in-process cache, never a shared Redis
+os.environ.pop('REDIS_URL', None)
+
+import pytest
+from datetime import datetime, timedelta, timezone
+from flask import Flask
+from sqlalchemy import BigInteger
+from sqlalchemy.ext.compiler import compiles
+from src.models.database import db, User, Credit, CreditType, CreditSource
+from src.services.cache import cache
+
+@compiles(BigInteger, 'sqlite')
+def _sqlite_bigint(type_, compiler, **kw):
+    # SQLite only auto-increments INTEGER PRIMARY KEY columns
+    return 'INTEGER'
+
+@pytest.fixture
+def app():
+    """Minimal app on an in-memory SQLite database with the schema created"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+    
+    cache._data.clear()
+
+@pytest.fixture
+def user(app):
+    """A user holding two active credits, the older one first"""
+    user = User(id=1, telegram_user_id=1001, first_name='Test')
+    now = datetime.now(timezone.utc)
+    db.session.add(user)
+    db.session.add_all([
+        Credit(id=1, user_id=1, credit_type=CreditType.FREE, amount=2, balance=2,
+               source=CreditSource.REGISTRATION, created_at=now - timedelta(days=1)),
+        Credit(id=2, user_id=1, credit_type=CreditType.PURCHASED, amount=5, balance=5,
+               source=CreditSource.PURCHASE, created_at=now)
+    ])
+    db.session.commit()
+    return user
@@ -0,0 +1,13 @@
+from src.models.database import db, AuditLog
+from src.services.audit_service import AUDIT_QUEUE, flush_audit_queue, record_audit
+
+def test_flush_writes_queued_entries(app, user):
+    record_audit('grant_credits', 'user', entity_id=user.id, user_id=user.id, new_values={'amount': 5})
+    record_audit('ban_user', 'user', entity_id=user.id, user_id=user.id)
+    
+    assert flush_audit_queue(app) == 2
+    assert AUDIT_QUEUE.empty()
+    assert sorted(db.session.scalars(db.select(AuditLog.action))) == ['ban_user', 'grant_credits']
+
+def test_flush_with_empty_queue(app):
+    assert flush_audit_queue(app) == 0
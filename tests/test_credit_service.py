@@ -0,0 +1,43 @@
+from src.models.database import db, Credit
+from src.services._profiling import count_queries
+from src.services.cache import cache
+from src.services.credit_service import CreditService, _balance_key
+
+def balances():
+    return dict(db.session.query(Credit.id, Credit.balance).order_by(Credit.id).all())
+
+def test_consume_credits_query_bound(app, user):
+    service = CreditService()
+    # Warm the balance cache, as any earlier bot interaction does
+    service.get_active_credit_balance(user.id)
+    
+    with count_queries(db.engine) as queries:
+        assert service.consume_credits(user.id, 1)
+    
+    assert queries.count <= 3, queries.statements
+
+def test_get_credit_statistics_single_query(app, user):
+    with count_queries(db.engine) as queries:
+        stats = CreditService().get_credit_statistics()
+    
+    assert stats
+    assert queries.count == 1, queries.statements
+
+def test_consume_credits_drains_oldest_first(app, user):
+    assert CreditService().consume_credits(user.id, 3)
+    
+    assert balances() == {1: 0, 2: 4}
+    assert db.session.get(Credit, 1).is_active is False
+
+def test_consume_credits_refuses_shortfall(app, user):
+    service = CreditService()
+    
+    assert not service.consume_credits(user.id, 8)
+    assert balances() == {1: 2, 2: 5}
+
+def test_stale_cached_shortfall_does_not_refuse_debit(app, user):
+    # A cached balance from before a grant must not turn the user away
+    cache.set(_balance_key(user.id), b'0')
+    
+    assert CreditService().consume_credits(user.id, 1)
+    assert balances() == {1: 1, 2: 5}
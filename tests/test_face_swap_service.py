@@ -0,0 +1,68 @@
+import pytest
+from src.models.database import db, Credit, FaceSwapJob, JobStatus, JobType
+from src.services.face_swap_service import FaceSwapService
+
+@pytest.fixture
+def service(app):
+    service = FaceSwapService()
+    yield service
+    service.worker_pool.shutdown()
+
+def add_job(job_id, user_id, credits=1, status=JobStatus.QUEUED):
+    db.session.add(FaceSwapJob(id=job_id, user_id=user_id, job_type=JobType.IMAGE,
+                               status=status, credits_consumed=credits))
+    db.session.commit()
+
+def job_status(job_id):
+    return db.session.scalar(db.select(FaceSwapJob.status).where(FaceSwapJob.id == job_id))
+
+def total_balance():
+    return db.session.scalar(db.select(db.func.sum(Credit.balance)))
+
+def test_start_job_claims_and_charges(service, user):
+    add_job(1, user.id)
+    
+    assert service._start_job(db.session.get(FaceSwapJob, 1)) is None
+    assert job_status(1) == JobStatus.PROCESSING
+    assert total_balance() == 6
+
+def test_start_job_skips_job_claimed_elsewhere(service, user):
+    add_job(1, user.id, status=JobStatus.PROCESSING)
+    
+    result = service._start_job(db.session.get(FaceSwapJob, 1))
+    assert result['claimed'] is False
+    assert job_status(1) == JobStatus.PROCESSING
+    assert total_balance() == 7
+
+def test_start_job_fails_unaffordable_job_without_charging(service, user):
+    add_job(1, user.id, credits=8)
+    
+    assert service._start_job(db.session.get(FaceSwapJob, 1))['success'] is False
+    assert job_status(1) == JobStatus.FAILED
+    assert total_balance() == 7
+
+def test_failed_debit_keeps_the_claim(service, user, monkeypatch):
+    add_job(1, user.id)
+    
+    def broken_consume(*args, **kwargs):
+        raise RuntimeError('debit failed')
+    monkeypatch.setattr(service.credit_service, 'consume_credits', broken_consume)
+    
+    # The savepoint undoes only the debit, so the job is failed under its own claim
+    assert service._start_job(db.session.get(FaceSwapJob, 1))['success'] is False
+    assert job_status(1) == JobStatus.FAILED
+    assert total_balance() == 7
+
+def test_claim_next_takes_oldest_queued_job_once(service, user):
+    add_job(1, user.id, status=JobStatus.COMPLETED)
+    add_job(2, user.id)
+    add_job(3, user.id)
+    
+    assert service.claim_next(JobType.IMAGE) == 2
+    assert service.claim_next() == 3
+    assert service.claim_next() is None
+    assert job_status(2) == JobStatus.PROCESSING
+    
+    # A claimed job is charged without being claimed again
+    assert service._start_job(db.session.get(FaceSwapJob, 2), claimed=True) is None
+    assert total_balance() == 6
@@ -0,0 +1,16 @@
+import warnings
+from src.models.database import db
+from src.services._profiling import count_queries
+from src.services.stats_service import StatsService
+
+def test_system_counts_single_query_without_warnings(app, user):
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        with count_queries(db.engine) as queries:
+            counts = StatsService().get_system_counts()
+    
+    assert queries.count == 1, queries.statements
+    assert counts['users_total'] == 1
+    assert counts['users_active'] == 1
+    assert counts['invites_total'] == 0
+    assert counts['jobs_total'] == 0